@@ -26,14 +26,15 @@ import warnings
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem, __version__
 
 
-def test_dut_firmware_and_model_name(nvme0):
-    logging.info(nvme0.id_data(63, 24, str))
-    logging.info(nvme0.id_data(71, 64, str))
+def test_dut_firmware_and_model_name(nvme0, id_cache):
+    id_ctrl = id_cache.controller(nvme0)
+    logging.info(id_ctrl.mn)
+    logging.info(id_ctrl.fr)
     logging.info("testing conformance with pynvme " + __version__)
 
     
-def test_abort_all_aer_commands(nvme0):
-    aerl = nvme0.id_data(259)+1
+def test_abort_all_aer_commands(nvme0, id_cache):
+    aerl = id_cache.controller(nvme0).aerl+1
     logging.info(aerl)
 
     def aer_cb(cdw0, status):
@@ -24,10 +24,11 @@ import logging
 import warnings
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
+from layout import decode_smart_log
 
 
-def test_aer_limit_exceeded(nvme0):
-    aerl = nvme0.id_data(259)+1
+def test_aer_limit_exceeded(nvme0, id_cache):
+    aerl = id_cache.controller(nvme0).aerl+1
     logging.info(aerl)
     
     # another one is sent in defaul nvme init
@@ -45,7 +46,7 @@ def test_aer_limit_exceeded(nvme0):
             nvme0.abort(127-i).waitdone()
 
 
-def test_aer_sanitize(pcie, buf):
+def test_aer_sanitize(pcie, buf, id_cache):
     # aer callback function
     aer_cdw0 = 0
     def aer_cb(cdw0, status):
@@ -89,6 +90,7 @@ def test_aer_sanitize(pcie, buf):
             
     logging.info("supported sanitize operation: %d" % nvme0.id_data(331, 328))
     nvme0.sanitize().waitdone()  # sanitize command is completed
+    id_cache.event("sanitize")
 
     # check sanitize status in log page
     with pytest.warns(UserWarning, match="AER notification is triggered"):
@@ -105,6 +107,7 @@ def test_aer_sanitize(pcie, buf):
         
     # test sanitize once more with new aer
     nvme0.sanitize().waitdone()  # sanitize command is completed
+    id_cache.event("sanitize")
     with pytest.warns(UserWarning, match="AER notification is triggered"):
         nvme0.getlogpage(0x81, buf, 20).waitdone()
         while buf.data(3, 2) & 0x7 != 1:  # sanitize operation is not completed
@@ -127,7 +130,7 @@ def test_aer_mask_event(nvme0):
     smart_log = Buffer()
     
     nvme0.getlogpage(0x02, smart_log, 512).waitdone()
-    ktemp = smart_log.data(2, 1)
+    ktemp = decode_smart_log(smart_log).temperature
     from pytemperature import k2c
     logging.info("temperature: %0.2f degreeC" % k2c(ktemp))
 
@@ -137,8 +140,8 @@ def test_aer_mask_event(nvme0):
 
     # AER should not be triggered here
     nvme0.getlogpage(0x02, smart_log, 512).waitdone()
-    logging.info(smart_log.data(0))
-    assert smart_log.data(0) & 0x2
+    logging.info(decode_smart_log(smart_log).critical_warning)
+    assert decode_smart_log(smart_log).critical_warning & 0x2
     
     # revert to default
     nvme0.setfeatures(4, cdw11=orig_config_4).waitdone()
@@ -149,7 +149,7 @@ def test_dst_invalid_stc(nvme0, buf, nsid=1):
 
 
 @pytest.mark.parametrize("stc", [1, 2])
-def test_dst_abort_by_format(nvme0, nvme0n1, stc, buf, nsid=1):
+def test_dst_abort_by_format(nvme0, nvme0n1, stc, buf, id_cache, nsid=1):
     if not nvme0.supports(0x14):
         pytest.skip("dst command is not supported")
 
@@ -159,6 +159,7 @@ def test_dst_abort_by_format(nvme0, nvme0n1, stc, buf, nsid=1):
     nvme0.dst(stc, nsid).waitdone()
 
     nvme0n1.format()
+    id_cache.event("format")
 
     # check if dst aborted
     nvme0.getlogpage(0x6, buf, 32).waitdone()
@@ -242,7 +243,7 @@ def test_dst_extended_abort_by_subsystem_reset(nvme0, subsystem, buf):
 
 
 @pytest.mark.parametrize("stc", [1, 2])
-def test_dst_abort_by_sanitize(nvme0, nvme0n1, stc, nsid=1):
+def test_dst_abort_by_sanitize(nvme0, nvme0n1, stc, id_cache, nsid=1):
     if not nvme0.supports(0x14):
         pytest.skip("dst command is not supported")
     if nvme0.id_data(331, 328) == 0:
@@ -262,6 +263,7 @@ def test_dst_abort_by_sanitize(nvme0, nvme0n1, stc, nsid=1):
     assert buf[0]
 
     nvme0.sanitize().waitdone()  # sanitize command is completed
+    id_cache.event("sanitize")
 
     # check sanitize status in log page
     with pytest.warns(UserWarning, match="AER notification is triggered"):
@@ -286,7 +288,7 @@ def test_dst_abort_by_sanitize(nvme0, nvme0n1, stc, nsid=1):
 
 
 @pytest.mark.parametrize("stc", [1, 2])
-def test_dst_after_sanitize(nvme0, nvme0n1, stc, nsid=1):
+def test_dst_after_sanitize(nvme0, nvme0n1, stc, id_cache, nsid=1):
     if not nvme0.supports(0x14):
         pytest.skip("dst command is not supported")
     if nvme0.id_data(331, 328) == 0:
@@ -299,6 +301,7 @@ def test_dst_after_sanitize(nvme0, nvme0n1, stc, nsid=1):
 
     logging.info("supported sanitize operation: %d" % nvme0.id_data(331, 328))
     nvme0.sanitize().waitdone()  # sanitize command is completed
+    id_cache.event("sanitize")
 
     with pytest.warns(UserWarning, match="ERROR status: 00/1d"):
         # dst aborted due to in-progress sanitize
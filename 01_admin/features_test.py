@@ -144,8 +144,8 @@ def test_features_invalid_sel(nvme0):
                 nvme0.getfeatures(fid=f, sel=s).waitdone()
 
     
-def test_features_set_volatile_write_cache(nvme0):
-    if not nvme0.id_data(525)&0x1:
+def test_features_set_volatile_write_cache(nvme0, id_cache):
+    if not id_cache.controller(nvme0).vwc&0x1:
         pytest.skip("volatile cache is not preset")
 
     def get_wce(nvme0):
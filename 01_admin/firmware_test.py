@@ -56,7 +56,7 @@ def test_fw_download_invalid_ofst(nvme0, size, offset):
         nvme0.fw_download(buf, offset, size).waitdone()
 
 
-def test_firmware_commit(nvme0):
+def test_firmware_commit(nvme0, id_cache):
     frmw = nvme0.id_data(260)
     slot1_ro = frmw&1
     slot_count = (frmw>>1)&7
@@ -82,3 +82,4 @@ def test_firmware_commit(nvme0):
         
     with pytest.warns(UserWarning, match="ERROR status: 01/07"):
         nvme0.fw_commit(1, 0).waitdone()
+    id_cache.event("fw_commit")
@@ -24,7 +24,7 @@ import logging
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
 
 
-def test_format_all_basic(nvme0, nvme0n1):
+def test_format_all_basic(nvme0, nvme0n1, id_cache):
     if not nvme0.supports(0x80):
         pytest.skip("format is not support")
 
@@ -46,10 +46,11 @@ def test_format_all_basic(nvme0, nvme0n1):
         nvme0.format(0, 1, 0xfffffffb).waitdone()
 
     nvme0n1.format(512)
+    id_cache.event("format")
     nvme0.timeout = orig_timeout
         
 
-def test_format_verify_data(nvme0, nvme0n1, verify, qpair):
+def test_format_verify_data(nvme0, nvme0n1, verify, qpair, id_cache):
     if not nvme0.supports(0x80):
         pytest.skip("format is not support")
 
@@ -105,10 +106,11 @@ def test_format_verify_data(nvme0, nvme0n1, verify, qpair):
         assert read_buf[10:21] == b'\0'*11
 
     nvme0n1.format(512)
+    id_cache.event("format")
     nvme0.timeout = orig_timeout
         
 
-def test_format_invalid_ses(nvme0, nvme0n1, verify, qpair):
+def test_format_invalid_ses(nvme0, nvme0n1, verify, qpair, id_cache):
     if not nvme0.supports(0x80):
         pytest.skip("format is not support")
 
@@ -129,10 +131,11 @@ def test_format_invalid_ses(nvme0, nvme0n1, verify, qpair):
     assert read_buf[10:21] == b'hello world'
     
     nvme0n1.format(512)
+    id_cache.event("format")
     nvme0.timeout = orig_timeout
 
     
-def test_format_invalid_lbaf(nvme0, nvme0n1, verify, qpair):
+def test_format_invalid_lbaf(nvme0, nvme0n1, verify, qpair, id_cache):
     if not nvme0.supports(0x80):
         pytest.skip("format is not support")
 
@@ -159,5 +162,6 @@ def test_format_invalid_lbaf(nvme0, nvme0n1, verify, qpair):
     assert read_buf[10:21] == b'hello world'        
 
     nvme0n1.format(512)
+    id_cache.event("format")
     nvme0.timeout = orig_timeout
     
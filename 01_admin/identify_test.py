@@ -138,3 +138,47 @@ def test_identify_nsze_ncap_nuse(nvme0, nvme0n1, buf):
     inaccessible_loss = ANACAP & 0xc
     if ana_reporting and inaccessible_loss:
         assert nuse == 0
+
+
+def test_identify_cache(nvme0, nvme0n1, id_cache):
+    buf = Buffer(4096)
+    nvme0.identify(buf, nsid=0, cns=1).waitdone()
+    assert id_cache.data(nvme0)[0:256] == buf[0:256]
+    assert id_cache.id_data(nvme0, 63, 24, str) == nvme0.id_data(63, 24, str)
+    assert id_cache.id_data(nvme0, 77) == nvme0.id_data(77)
+    assert id_cache.ns_data(nvme0, 7, 0) == nvme0n1.id_data(7, 0)
+    assert id_cache.ns_data(nvme0, 15, 8) == nvme0n1.id_data(15, 8)
+
+    # decoded records
+    id_ctrl = id_cache.controller(nvme0)
+    assert id_ctrl.mn == nvme0.id_data(63, 24, str)
+    assert id_ctrl.hmpre == nvme0.id_data(275, 272)
+    assert id_ctrl.aerl == nvme0.id_data(259)
+    assert id_ctrl.vwc == nvme0.id_data(525)
+    assert id_ctrl.rtd3e == nvme0.id_data(91, 88)
+    assert len(id_ctrl.psd) == 32
+    assert id_ctrl.psd[0].enlat == nvme0.id_data(2048+7, 2048+4)
+    id_ns = id_cache.namespace(nvme0)
+    assert id_ns.ncap == nvme0n1.id_data(15, 8)
+    assert id_ns.npwg == nvme0n1.id_data(65, 64)
+    assert id_ns.nows == nvme0n1.id_data(73, 72)
+    assert id_cache.controller(nvme0) is id_ctrl
+
+    # no identify command when the data is cached
+    hit, miss = id_cache.hit, id_cache.miss
+    id_cache.controller(nvme0)
+    id_cache.namespace(nvme0)
+    assert id_cache.hit == hit+2
+    assert id_cache.miss == miss
+
+    # namespace identification descriptor list
+    nvme0.identify(buf, nsid=1, cns=3).waitdone()
+    assert id_cache.ns_descriptors(nvme0)[0:64] == buf[0:64]
+
+    # format drops the namespace data, but keeps the controller data
+    id_cache.event("format", 1)
+    miss = id_cache.miss
+    assert id_cache.ns_data(nvme0, 26) == nvme0n1.id_data(26)
+    assert id_cache.controller(nvme0) is id_ctrl
+    assert id_cache.miss == miss+1
+    logging.info(id_cache.stats())
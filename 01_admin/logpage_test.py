@@ -23,6 +23,7 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
+from layout import decode_smart_log
 
 
 def test_getlogpage_page_id(nvme0, buf):
@@ -72,13 +73,13 @@ def test_getlogpage_data_unit_read(nvme0, nvme0n1, buf, qpair, len):
     nvme0n1.write(qpair, buf, 0, len).waitdone()
 
     nvme0.getlogpage(2, buf).waitdone()
-    nread1 = buf.data(47, 32)
+    nread1 = decode_smart_log(buf).data_units_read
 
     # read
     for i in range(1000):
         nvme0n1.read(qpair, buf, 0, len).waitdone()
     nvme0.getlogpage(2, buf).waitdone()
-    nread2 = buf.data(47, 32)
+    nread2 = decode_smart_log(buf).data_units_read
     assert nread2 == nread1+len
 
     # compare
@@ -86,7 +87,7 @@ def test_getlogpage_data_unit_read(nvme0, nvme0n1, buf, qpair, len):
     for i in range(1000):
         nvme0n1.compare(qpair, buf, 0, len).waitdone()
     nvme0.getlogpage(2, buf).waitdone()
-    nread3 = buf.data(47, 32)
+    nread3 = decode_smart_log(buf).data_units_read
     assert nread3 == nread2+len
 
     # verify
@@ -94,7 +95,7 @@ def test_getlogpage_data_unit_read(nvme0, nvme0n1, buf, qpair, len):
         for i in range(1000):
             nvme0n1.verify(qpair, 0, len).waitdone()
         nvme0.getlogpage(2, buf).waitdone()
-        nread4 = buf.data(47, 32)
+        nread4 = decode_smart_log(buf).data_units_read
         assert nread4 == nread3+len    
 
 
@@ -106,20 +107,20 @@ def test_getlogpage_data_unit_write(nvme0, nvme0n1, len, buf, qpair):
     nvme0n1.write(qpair, buf, 0).waitdone()
 
     nvme0.getlogpage(2, buf).waitdone()
-    nwrite1 = buf.data(63, 48)
+    nwrite1 = decode_smart_log(buf).data_units_written
 
     for i in range(1000):
         nvme0n1.write(qpair, buf, 0, len).waitdone()
 
     nvme0.getlogpage(2, buf).waitdone()
-    nwrite2 = buf.data(63, 48)
+    nwrite2 = decode_smart_log(buf).data_units_written
     assert nwrite2 == nwrite1+len
     
     for i in range(1000):
         nvme0n1.write_uncorrectable(qpair, 0, len).waitdone()
 
     nvme0.getlogpage(2, buf).waitdone()
-    nwrite3 = buf.data(63, 48)
+    nwrite3 = decode_smart_log(buf).data_units_written
     assert nwrite3 == nwrite2
 
     nvme0n1.write(qpair, Buffer(4096), 0, 8).waitdone()
@@ -129,7 +130,7 @@ def test_getlogpage_data_unit_write(nvme0, nvme0n1, len, buf, qpair):
 def test_getlogpage_power_cycle_count(nvme0, subsystem, buf):
     def get_power_cycles(nvme0):
         nvme0.getlogpage(2, buf, 512).waitdone()
-        return buf.data(115, 112)
+        return decode_smart_log(buf).power_cycles
 
     powercycle = get_power_cycles(nvme0)
     subsystem.poweroff()
@@ -154,7 +155,7 @@ def test_getlogpage_smart_composite_temperature(nvme0):
     smart_log = Buffer()
     
     nvme0.getlogpage(0x02, smart_log, 512).waitdone()
-    ktemp = smart_log.data(2, 1)
+    ktemp = decode_smart_log(smart_log).temperature
     logging.debug("temperature: %d degreeF" % ktemp)
 
     # warning with AER
@@ -163,16 +164,16 @@ def test_getlogpage_smart_composite_temperature(nvme0):
         nvme0.setfeatures(4, cdw11=ktemp-10).waitdone()
         
         nvme0.getlogpage(0x02, smart_log, 512).waitdone()
-        logging.debug("0x%x" % smart_log.data(0))
+        logging.debug("0x%x" % decode_smart_log(smart_log).critical_warning)
         nvme0.getlogpage(0x02, smart_log, 512).waitdone()    
-        assert smart_log.data(0) & 0x2
+        assert decode_smart_log(smart_log).critical_warning & 0x2
 
         # higher threshold
         nvme0.setfeatures(4, cdw11=ktemp+10).waitdone()
 
     # aer is not expected
     nvme0.getlogpage(0x02, smart_log, 512).waitdone()
-    ktemp = smart_log.data(2, 1)
+    ktemp = decode_smart_log(smart_log).temperature
     logging.debug("temperature: %d degreeF" % ktemp)
 
     # revert to default
@@ -23,6 +23,7 @@ import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
 from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from config_space import capabilities
 
 
 @pytest.fixture(scope="function")
@@ -288,7 +289,7 @@ def test_create_sq_with_invalid_cqid(nvme0,mqes):
 
 
 def test_create_cq_invalid_interrupt_vector(nvme0, pcie):
-    msicap_addr = pcie.cap_offset(0x05)
+    msicap_addr = capabilities(pcie).offset(0x05)
     msicap = pcie.register(msicap_addr, 4)
     logging.info("MSI Enable: %d" % ((msicap>>16)&0x1))
     logging.info("Multiple Message Capable: %d" % ((msicap>>17)&0x7))
@@ -297,7 +298,7 @@ def test_create_cq_invalid_interrupt_vector(nvme0, pcie):
         invalid_iv = ((msicap>>17)&0x7) + 2
         logging.info("invalid_iv: %d" % invalid_iv)
 
-    msixcap_addr = pcie.cap_offset(0x11)
+    msixcap_addr = capabilities(pcie).offset(0x11)
     msixcap = pcie.register(msixcap_addr, 4)
     logging.info("Table Size: %d" % ((msixcap>>16)&0x3ff))
     logging.info("MSI-X Enable: %d" % ((msixcap>>31)&0x1))
@@ -26,7 +26,7 @@ import warnings
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
 
 
-def test_sanitize_operations_basic(nvme0, nvme0n1, buf):
+def test_sanitize_operations_basic(nvme0, nvme0n1, buf, id_cache):
     if nvme0.id_data(331, 328) == 0:  #L9
         pytest.skip("sanitize operation is not supported")  #L10
 
@@ -45,9 +45,10 @@ def test_sanitize_operations_basic(nvme0, nvme0n1, buf):
     # check sanitize status
     nvme0.getlogpage(0x81, buf, 20).waitdone()
     assert buf.data(3, 2) & 0x7 == 1
+    id_cache.event("sanitize")
 
 
-def test_sanitize_operations_powercycle(nvme0, buf, subsystem):
+def test_sanitize_operations_powercycle(nvme0, buf, subsystem, id_cache):
     return
     if nvme0.id_data(331, 328) == 0:  #L9
         pytest.skip("sanitize operation is not supported")  #L10
@@ -73,6 +74,7 @@ def test_sanitize_operations_powercycle(nvme0, buf, subsystem):
     # check sanitize status
     nvme0.getlogpage(0x81, buf, 20).waitdone()
     assert buf.data(3, 2) & 0x7 == 1
+    id_cache.event("sanitize")
 
     # recover power mode
     nvme0.setfeatures(0x2, cdw11=0).waitdone()
@@ -95,7 +97,7 @@ def test_sanitize_operations_powercycle_post(nvme0, nvme0n1, buf, subsystem, qpa
                      read_percentage=100, time=10).start().close()
     
     
-def test_write_in_sanitize_operations(nvme0, nvme0n1, buf, qpair):
+def test_write_in_sanitize_operations(nvme0, nvme0n1, buf, qpair, id_cache):
     if nvme0.id_data(331, 328) == 0:  #L9
         pytest.skip("sanitize operation is not supported")  #L10
 
@@ -117,5 +119,6 @@ def test_write_in_sanitize_operations(nvme0, nvme0n1, buf, qpair):
     # check sanitize status
     nvme0.getlogpage(0x81, buf, 20).waitdone()
     assert buf.data(3, 2) & 0x7 == 1
+    id_cache.event("sanitize")
 
 
@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
 
 
 @pytest.fixture()
@@ -82,8 +83,8 @@ def test_compare_invalid_nsid(nvme0, nvme0n1, nsid, cq, sq):
     cmd.prp1 = buf
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     assert status == 0x000b or status == 0x0002
 
 
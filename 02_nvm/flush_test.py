@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
 
 
 @pytest.fixture()
@@ -57,8 +58,8 @@ def test_flush_invalid_nsid(nvme0, nvme0n1, cq, sq):
     cmd = SQE(0, 0xff)
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     assert status == 0x000b
 
     
@@ -67,8 +68,8 @@ def test_flush_all_namespace(nvme0, nvme0n1, cq, sq):
     cmd = SQE(0, 0xffffffff)
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     
     # NVMe1.4 page258: If bits 2:1 are set to 11b in the VWC field (refer to Figure 247) and the specified NSID is FFFFFFFFh, then
     # the Flush command applies to all namespaces attached to the controller processing the Flush command.
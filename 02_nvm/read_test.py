@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
 
 
 @pytest.fixture()
@@ -120,8 +121,8 @@ def test_read_invalid_nsid(nvme0, nvme0n1, cq, sq):
     cmd.prp1 = buf
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     assert status == 0x000b
 
     
@@ -139,8 +140,8 @@ def test_read_invalid_nlb(nvme0, nvme0n1, cq, sq):
     cmd[12] = mdts//512
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     assert status == 0x0002  # invalid field
 
     
@@ -156,8 +157,8 @@ def test_read_invalid_nsid_lba(nvme0, nvme0n1, cq, sq):
     cmd[11] = ncap>>32
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     assert status == 0x000b  # invalid namespace or format
 
     
@@ -172,8 +173,8 @@ def test_read_invalid_prp_address_offset(nvme0, cq, sq):
     cmd.prp1 = buf
     sq[0] = cmd
     sq.tail = 1
-    time.sleep(0.1)
-    status = (cq[0][3]>>17)&0x7ff
+    cqe = cq.waitdone()[0]
+    status = (cqe.sct<<8)|cqe.sc
     
     if status == 0:
         # write success, check data
@@ -182,8 +183,8 @@ def test_read_invalid_prp_address_offset(nvme0, cq, sq):
         cmd.prp1 = buf
         sq[1] = cmd
         sq.tail = 2
-        time.sleep(0.1)
-        status = (cq[1][3]>>17)&0x7ff
+        cqe = cq.waitdone()[0]
+        status = (cqe.sct<<8)|cqe.sc
         assert status == 0
         logging.info(buf.dump(16))
         assert first_byte == buf[0]
@@ -27,8 +27,8 @@ from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
 
 
 @pytest.fixture(scope="function")
-def hmb(nvme0, buf):
-    hmb_size = nvme0.id_data(275, 272)
+def hmb(nvme0, buf, id_cache):
+    hmb_size = id_cache.controller(nvme0).hmpre
     if hmb_size == 0:
         pytest.skip("hmb is not supported")
     
@@ -65,8 +65,8 @@ def hmb(nvme0, buf):
     logging.info("hmb disabled")
 
 
-def test_hmb_single_buffer(nvme0, nvme0n1, hmb):
-    hmb_size = nvme0.id_data(275, 272)
+def test_hmb_single_buffer(nvme0, nvme0n1, hmb, id_cache):
+    hmb_size = id_cache.controller(nvme0).hmpre
     if hmb_size == 0:
         pytest.skip("hmb is not supported")
 
@@ -85,8 +85,8 @@ def test_hmb_single_buffer(nvme0, nvme0n1, hmb):
         pass
         
         
-def test_hmb_multiple_buffer(nvme0, nvme0n1, buf):
-    hmb_size = nvme0.id_data(275, 272)
+def test_hmb_multiple_buffer(nvme0, nvme0n1, buf, id_cache):
+    hmb_size = id_cache.controller(nvme0).hmpre
     if hmb_size == 0:
         pytest.skip("hmb is not supported")
 
@@ -155,12 +155,13 @@ def test_hmb_multiple_buffer(nvme0, nvme0n1, buf):
     logging.info(hmb_buf_2.dump(64))
 
     
-def _test_reset_with_hmb_disabled(nvme0, nvme0n1, buf):
-    hmb_size = nvme0.id_data(275, 272)
+def _test_reset_with_hmb_disabled(nvme0, nvme0n1, buf, id_cache):
+    hmb_size = id_cache.controller(nvme0).hmpre
     if hmb_size == 0:
         pytest.skip("hmb is not supported")
         
     nvme0n1.format(512)
+    id_cache.event("format")
 
     # single host memory buffer
     hmb_buf = Buffer(4096*hmb_size+4096)
@@ -200,8 +201,8 @@ def _test_reset_with_hmb_disabled(nvme0, nvme0n1, buf):
     del hmb_list_buf
     
 
-def test_multiple_hmb_buffer(nvme0, nvme0n1, buf):
-    hmb_size = nvme0.id_data(275, 272)
+def test_multiple_hmb_buffer(nvme0, nvme0n1, buf, id_cache):
+    hmb_size = id_cache.controller(nvme0).hmpre
     if hmb_size == 0:
         pytest.skip("hmb is not supported")
 
@@ -18,18 +18,46 @@
 # -*- coding: utf-8 -*-
 
 
+import time
 import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
 from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from dma import verify_pattern
+from bench import power_state_latency, apst_sweep, race_search, percentiles
 
 
-def test_apst_enabled(nvme0):
-    if not nvme0.id_data(265):
+@pytest.fixture()
+def apst_restore(nvme0):
+    # the APST setting changed by the test is restored at the end
+    orig = Buffer(4096)
+    apste = nvme0.getfeatures(0xc, buf=orig).waitdone()&0x1
+    yield
+    nvme0.setfeatures(0xc, cdw11=apste, buf=orig).waitdone()
+
+
+def test_apst_enabled(nvme0, nvme0n1, qpair, id_cache):
+    id_ctrl = id_cache.controller(nvme0)
+    if not id_ctrl.apsta:
         pytest.skip("APST is not enabled")
+    psd = id_ctrl.psd[:id_ctrl.npss+1]
+    if not any(ps.flags&0x2 for ps in psd):
+        pytest.skip("no non-operational power state")
 
-    pass
+    # idle twice of every threshold between bursts
+    result = apst_sweep(nvme0, nvme0n1, qpair, psd, [1, 10, 20, 100, 1000],
+                        rounds=10)
+    for r in result:
+        logging.info("ITPT %sms: idle %dms, %d%% entered, wake %dus (+%dus), "
+                     "%d IOPS" %
+                     (r.idle_ms, r.idle*1000, r.entered*100, r.wake[50]*1000000,
+                      r.wake_penalty*1000000, r.iops))
+
+    # the power state changes only when APST is enabled and idle is longer
+    assert result[0].entered == 0
+    for r in result[1:]:
+        assert r.entered > 0, "no transition after %dms idle" % (r.idle*1000)
 
 
 def test_host_controlled_thermal_management_enabled(nvme0):
@@ -40,36 +68,56 @@ def test_host_controlled_thermal_management_enabled(nvme0):
 
 
 @pytest.mark.parametrize("ps", [4, 3, 2, 1, 0])
-def test_format_at_power_state(nvme0, nvme0n1, ps):
+def test_format_at_power_state(nvme0, nvme0n1, ps, id_cache):
     nvme0.setfeatures(0x2, cdw11=ps).waitdone()
     assert nvme0n1.format(ses=0) == 0
     assert nvme0n1.format(ses=1) == 0
+    id_cache.event("format")
     p = nvme0.getfeatures(0x2).waitdone()
     assert p == ps
 
 
-def read_write_8M(nvme0n1, qpair):
-    buf128k = Buffer(128*1024)
+def read_write_8M(nvme0n1, qpair, buffer_pool):
     lba128k = 128*1024//512
 
-    # write all data
-    slba = 0x10000
-    for i in range(64):
-        nvme0n1.write(qpair, buf128k, slba, lba128k)
-        slba += lba128k
-    qpair.waitdone(64)
-
-    # read all data
-    slba = 0x10000
-    for i in range(64):
-        nvme0n1.read(qpair, buf128k, slba, lba128k)
-        slba += lba128k
-    qpair.waitdone(64)
-            
-    
+    with buffer_pool.buffer(128*1024) as buf128k:
+        # write all data
+        slba = 0x10000
+        for i in range(64):
+            nvme0n1.write(qpair, buf128k, slba, lba128k)
+            slba += lba128k
+        qpair.waitdone(64)
+
+        # read all data
+        slba = 0x10000
+        for i in range(64):
+            nvme0n1.read(qpair, buf128k, slba, lba128k)
+            slba += lba128k
+        qpair.waitdone(64)
+
+
+def test_power_state_latency_matrix(nvme0, nvme0n1, qpair, buf, id_cache,
+                                    apst_restore):
+    id_ctrl = id_cache.controller(nvme0)
+
+    # disable apst
+    nvme0.setfeatures(0xc, buf=buf).waitdone()
+
+    result = power_state_latency(nvme0, nvme0n1, qpair,
+                                 id_ctrl.psd[:id_ctrl.npss+1])
+    for r in result:
+        logging.info("PS%d -> PS%d: transition %dus (limit %dus), "
+                     "first IO %dus (limit %dus)" %
+                     (r.ps_from, r.ps_to,
+                      r.transition[99]*1000000, r.transition_limit*1000000,
+                      r.first_io[99]*1000000, r.first_io_limit*1000000))
+    violations = [(r.ps_from, r.ps_to) for r in result if r.violation]
+    assert not violations, "transitions exceed ENLAT/EXLAT: %s" % violations
+
+
 @pytest.mark.parametrize("ps_from", [0, 1, 2, 3, 4])
 @pytest.mark.parametrize("ps_to", [0, 1, 2, 3, 4])
-def test_power_state_transition(pcie, nvme0, nvme0n1, buf, qpair, ps_from, ps_to):
+def test_power_state_transition(pcie, nvme0, nvme0n1, buf, qpair, buffer_pool, ps_from, ps_to):
     # for accurate sleep delay
     import ctypes
     libc = ctypes.CDLL('libc.so.6')
@@ -92,7 +140,7 @@ def test_power_state_transition(pcie, nvme0, nvme0n1, buf, qpair, ps_from, ps_to
         libc.usleep(1000)
 
         # write and read data to invalidate cache
-        read_write_8M(nvme0n1, qpair)
+        read_write_8M(nvme0n1, qpair, buffer_pool)
 
         # set end state
         nvme0.setfeatures(0x2, cdw11=ps_to)
@@ -101,8 +149,8 @@ def test_power_state_transition(pcie, nvme0, nvme0n1, buf, qpair, ps_from, ps_to
         # read lba 0x5a and verify data
         nvme0n1.read(qpair, buf, 0x5a).waitdone()
         assert buf[0] == 0x5a
-        for i in range(8, 512-8):
-            assert buf[i] == 0x5a
+        first, count = verify_pattern(buf, "const", 0x5a, start=8, end=512-8)
+        assert count == 0, "%d bytes mismatch from 0x%x" % (count, first)
 
         # consume the cpl of setfeatures above
         nvme0.waitdone()  # for setfeautres above
@@ -112,7 +160,7 @@ def test_power_state_transition(pcie, nvme0, nvme0n1, buf, qpair, ps_from, ps_to
     nvme0.setfeatures(0x2, cdw11=orig_ps).waitdone()
 
 
-def test_power_state_transition_0_3_4(pcie, nvme0, nvme0n1, qpair, buf):
+def test_power_state_transition_0_3_4(pcie, nvme0, nvme0n1, qpair, buf, buffer_pool, id_cache, budget=500):
     # for accurate sleep delay
     import ctypes
     libc = ctypes.CDLL('libc.so.6')
@@ -127,34 +175,63 @@ def test_power_state_transition_0_3_4(pcie, nvme0, nvme0n1, qpair, buf):
     # write data to LBA 0x5a
     buf = Buffer(512, ptype=32, pvalue=0x5a5a5a5a)
     nvme0n1.write(qpair, buf, 0x5a).waitdone()
-    
-    # test with delay 1us-10ms, 100 times each us
-    for delay in range(10000):
+
+    # baseline of the read latency in PS0
+    nvme0.setfeatures(0x2, cdw11=0).waitdone()
+    samples = []
+    for i in range(100):
+        start = time.perf_counter()
+        nvme0n1.read(qpair, buf, 0x5a).waitdone()
+        samples.append(time.perf_counter()-start)
+    base = percentiles(samples)[99]
+
+    # outlier: slower than the baseline by the transitions of PS3 and
+    # PS4, with 1ms for the host
+    psd = id_cache.controller(nvme0).psd
+    latency_limit = base+(psd[3].exlat+psd[4].enlat+psd[4].exlat)/1000000+0.001
+
+    def probe(delay):
         # write and read data to invalidate cache
-        read_write_8M(nvme0n1, qpair)
-        
+        read_write_8M(nvme0n1, qpair, buffer_pool)
+
         # PS0
         nvme0.setfeatures(0x2, cdw11=0).waitdone()
         libc.usleep(1000)
-        
+
         # PS3, read, and PS4
         nvme0.setfeatures(0x2, cdw11=3)
         libc.usleep(delay)
+        start = time.perf_counter()
         nvme0n1.read(qpair, buf, 0x5a)
         nvme0.setfeatures(0x2, cdw11=4)
 
         # check read result
         qpair.waitdone()
-        assert buf[0] == 0x5a
-        for i in range(8, 512-8):
-            assert buf[i] == 0x5a
+        latency = time.perf_counter()-start
+        first, count = verify_pattern(buf, "const", 0x5a, start=8, end=512-8)
 
         # consume the cpl of setfeatures above
         nvme0.waitdone(2)
+        if buf[0] != 0x5a or count != 0:
+            return "data"
+        if latency > latency_limit:
+            return "latency"
+
+    # search the race windows in delay 1us-10ms
+    result = race_search(probe, 1, 10000, budget)
+    logging.info("%d delays probed" % len(result.samples))
+    for cls, windows in result.windows.items():
+        logging.info("%s windows of delay (us): %s" % (cls, windows))
+    if "latency" in result.windows:
+        logging.warning("read latency over %dus (baseline p99 %dus) at delay (us): %s" %
+                        (latency_limit*1000000, base*1000000,
+                         result.windows["latency"]))
 
     # recover to original power state
     pcie.aspm = 0
     nvme0.setfeatures(0x2, cdw11=orig_ps).waitdone()
+    assert "data" not in result.windows, \
+        "race windows of delay (us): %s" % result.windows["data"]
 
 
 def test_power_state_async_with_io(pcie, nvme0, nvme0n1, buf, verify, duration=100):
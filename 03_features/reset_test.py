@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOCQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOSQ, SQEBatch
 
 
 # PCIe, different of power states and resets
@@ -56,24 +57,19 @@ def test_power_and_reset(pcie, nvme0, subsystem):
 
 
 @pytest.mark.parametrize("delay", [1, 0.1, 0.01])
-def test_reset_with_outstanding_io(nvme0, nvme0n1, delay, io_count=100):
+def test_reset_with_outstanding_io(nvme0, nvme0n1, delay, id_cache, io_count=100):
     nvme0n1.format(512)
+    id_cache.event("format")
     logging.debug("format done")
     
     cq = IOCQ(nvme0, 1, 128, PRP(1024*64))
     sq = IOSQ(nvme0, 1, 128, PRP(1024*64), cqid=1)
 
-    write_cmd = SQE(1, 1)
-    write_cmd[12] = 7  # 4K write
-    buf_list = []
-    for i in range(io_count):
-        buf = PRP(ptype=32, pvalue=i)  # use cid as data pattern
-        buf_list.append(buf)
-        write_cmd.prp1 = buf
-        write_cmd.cid = i
-        write_cmd[10] = i
-        sq[i] = write_cmd
-    sq.tail = io_count
+    # use cid as data pattern
+    buf_list = [PRP(ptype=32, pvalue=i) for i in range(io_count)]
+    write_batch = SQEBatch(io_count, opcode=1, nsid=1)
+    write_batch.cid(0).slba(0, 1).nlb(7).prp1(buf_list)  # 4K write
+    sq.tail = sq.put(write_batch)
 
     # reset while io is active
     logging.debug("write done")
@@ -84,17 +80,10 @@ def test_reset_with_outstanding_io(nvme0, nvme0n1, delay, io_count=100):
     cq = IOCQ(nvme0, 1, 128, PRP(1024*64))
     sq = IOSQ(nvme0, 1, 128, PRP(1024*64), cqid=1)
 
-    read_cmd = SQE(2, 1)
-    read_cmd[12] = 7  # 4K read
-    buf_list = []
-    for i in range(io_count):
-        buf = PRP()
-        buf_list.append(buf)
-        read_cmd.prp1 = buf
-        read_cmd.cid = i
-        read_cmd[10] = i
-        sq[i] = read_cmd
-    sq.tail = io_count
+    buf_list = [PRP() for i in range(io_count)]
+    read_batch = SQEBatch(io_count, opcode=2, nsid=1)
+    read_batch.cid(0).slba(0, 1).nlb(7).prp1(buf_list)  # 4K read
+    sq.tail = sq.put(read_batch)
     logging.debug("read done")
 
     # data verify
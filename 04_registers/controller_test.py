@@ -24,6 +24,7 @@ import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
 from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from bench import ready_latency
 
 
 def test_controller_cap(nvme0):
@@ -93,7 +94,18 @@ def test_controller_cap_to(nvme0):
     while (nvme0[0x1c]&0x1)==0: pass
     assert time.time()-time_start < max_time
 
-    
+
+def test_controller_ready_latency(nvme0, cycles=20):
+    r = ready_latency(nvme0, cycles)
+    nvme0.reset()
+
+    logging.info("CAP.TO: %dms" % (r.timeout*1000))
+    for name, latency in (("disable", r.disable), ("enable", r.enable)):
+        logging.info("%s (ms): %s" % (name, {p: "%.3f" % (l*1000)
+                                            for p, l in latency.items()}))
+        assert latency[100] < r.timeout
+
+
 def test_controller_cap_mqes(nvme0):
     mqes = 1+(nvme0.cap&0xffff)
     logging.info(mqes)
@@ -221,7 +233,7 @@ def test_controller_cc_css(nvme0):
     logging.info("css:{}".format(css))
 
 
-def test_controller_mdts(nvme0,nvme0n1):
+def test_controller_mdts(nvme0,nvme0n1, prp_chains):
     if nvme0.mdts == 1024*1024: # up to 1MB
         pytest.skip("mdts is maximum")
 
@@ -240,30 +252,11 @@ def test_controller_mdts(nvme0,nvme0n1):
     sq = IOSQ(nvme0, 1, 5, PRP(), cqid=1)
 
     # prp for the long buffer
-    write_buf_1 = PRP(ptype=32, pvalue=0xaaaaaaaa)
-    prp_list = PRPList()
-    prp_list_head = prp_list
-    while pages:
-        for i in range(511):
-            if pages:
-                prp_list[i] = PRP()
-                pages -= 1
-                logging.debug(pages)
-
-        if pages>1:
-            tmp = PRPList()
-            prp_list[511] = tmp
-            prp_list = tmp
-            logging.debug("prp_list")
-
-        elif pages==1:
-            prp_list[511] = PRP()
-            pages -= 1
-            logging.debug(pages)
+    chain = prp_chains.get(nvme0, max_data_size, ptype=32, pvalue=0xaaaaaaaa)
+    logging.debug("%d pages" % len(chain))
 
     w1 = SQE(1, 1)
-    w1.prp1 = write_buf_1
-    w1.prp2 = prp_list_head
+    chain.fill(w1)
     w1[12] = max_lba-1 # 0based, nlba
     w1.cid = 0x123
     sq[0] = w1
@@ -279,8 +272,7 @@ def test_controller_mdts(nvme0,nvme0n1):
     cq.head = 1
 
     w2 = SQE(1, 1)
-    w2.prp1 = write_buf_1
-    w2.prp2 = prp_list_head
+    chain.fill(w2)
     w2[12] = max_lba # 0based, nlba
     w2.cid = 0x234
     sq[1] = w2
@@ -296,8 +288,7 @@ def test_controller_mdts(nvme0,nvme0n1):
     cq.head = 2
 
     r1 = SQE(2, 1)
-    r1.prp1 = write_buf_1
-    r1.prp2 = prp_list_head
+    chain.fill(r1)
     r1[12] = max_lba # 0based, nlba
     r1.cid = 0x345
     sq[2] = r1
@@ -313,8 +304,7 @@ def test_controller_mdts(nvme0,nvme0n1):
     cq.head = 3
 
     r2 = SQE(2, 1)
-    r2.prp1 = write_buf_1
-    r2.prp2 = prp_list_head
+    chain.fill(r2)
     r2[12] = max_lba-1 # 0based, nlba
     r2.cid = 0x456
     sq[3] = r2
@@ -22,7 +22,10 @@ import time
 import pytest
 import logging
 
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
+from bench import bandwidth, retrain, link_speed, aspm_latency, l1_exit_latency
+from config_space import capabilities, ConfigSpace
 
 
 def test_pcie_identifiers(pcie):
@@ -53,7 +56,7 @@ def test_pcie_bist(pcie):
     
     
 def test_pcie_pmcr(pcie):
-    pmcr_addr = pcie.cap_offset(0x01)
+    pmcr_addr = capabilities(pcie).offset(0x01)
     pmcr = pcie.register(pmcr_addr, 4)
     logging.info("pmcr register [0x%x]= 0x%x"% (pmcr_addr, pmcr))
     logging.info("Version: %d" % ((pmcr>>16)&7))
@@ -61,7 +64,7 @@ def test_pcie_pmcr(pcie):
 
     
 def test_pcie_pmcsr(pcie):
-    pmcsr_addr = pcie.cap_offset(0x01)+4
+    pmcsr_addr = capabilities(pcie).offset(0x01)+4
     pmcsr = pcie.register(pmcsr_addr, 4)
     logging.info("pmcsr register [0x%x]= 0x%x"% (pmcsr_addr, pmcsr))
     logging.info("power state %d" % ((pmcsr>>0)&3))
@@ -74,7 +77,7 @@ def test_pcie_pmcsr(pcie):
     
 
 def test_pcie_pcie_cap(pcie):
-    pciecap_addr = pcie.cap_offset(0x10)
+    pciecap_addr = capabilities(pcie).offset(0x10)
     pciecap = pcie.register(pciecap_addr, 4)
     logging.info("pcie capability register [0x%x]= 0x%x"% (pciecap_addr, pciecap))
     logging.info("capability version: %d" % ((pciecap>>16)&0x7))
@@ -100,29 +103,49 @@ def test_pcie_pcie_cap(pcie):
 
     
 def test_pcie_link_capabilities_and_status(pcie):
-    linkcap_addr = pcie.cap_offset(0x10)+12
+    pciecap_addr = capabilities(pcie).offset(0x10)
+    linkcap_addr = pciecap_addr+12
     linkcap = pcie.register(linkcap_addr, 4)
     logging.info("link capability register [0x%x]= 0x%x"% (linkcap_addr, linkcap))    
     logging.info("max link speed: %d"% ((linkcap>>0)&0xf))
     logging.info("max link width: %d"% ((linkcap>>4)&0x3f))
     logging.info("ASPM Support: %d"% ((linkcap>>10)&0x3))
 
-    linkctrl_addr = pcie.cap_offset(0x10)+16
+    linkctrl_addr = pciecap_addr+16
     linkctrl = pcie.register(linkctrl_addr, 2)
     logging.info("link control register [0x%x]= 0x%x"% (linkctrl_addr, linkctrl))    
     
-    linksts_addr = pcie.cap_offset(0x10)+18
-    linksts = pcie.register(linkcap_addr, 2)
+    linksts_addr = pciecap_addr+18
+    linksts = pcie.register(linksts_addr, 2)
     logging.info("link status register [0x%x]= 0x%x"% (linksts_addr, linksts))
     logging.info("link speed: %d"% ((linksts>>0)&0xf))
     logging.info("link width: %d"% ((linksts>>4)&0x3f))
     logging.info("link training: %d"% ((linksts>>11)&0x1))
     logging.info("link active: %d"% ((linksts>>13)&0x1))
 
+
+def test_pcie_config_snapshot(pcie, nvme0):
+    before = ConfigSpace(pcie)
+    caps = capabilities(pcie)
+    for cap_id in (0x01, 0x05, 0x10, 0x11):
+        assert before.caps.offset(cap_id) == caps.offset(cap_id)
+    assert before["class_code"] == 0x010802
+    logging.info("capabilities: %s" % before.caps)
+    logging.info("link speed %d, width %d" %
+                 (before["link_speed"], before["link_width"]))
+
+    pcie.reset()
+    nvme0.reset()
+    after = ConfigSpace(pcie)
+    logging.info("changed after reset: %s" % dict(before.diff(after)))
+    logging.info("changed dwords: %s" % [hex(o) for o in before.changed(after)])
+    assert after["vendor_id"] == before["vendor_id"]
+    assert after["device_id"] == before["device_id"]
+
     
 @pytest.mark.parametrize("aspm", [0, 2])
 def test_pcie_link_control_aspm(nvme0, pcie, aspm): #1:0
-    linkctrl_addr = pcie.cap_offset(0x10)+16
+    linkctrl_addr = capabilities(pcie).offset(0x10)+16
     linkctrl = pcie.register(linkctrl_addr, 2)
     logging.info("link control register [0x%x]= 0x%x" %
                  (linkctrl_addr, linkctrl))
@@ -140,19 +163,13 @@ def test_pcie_link_control_aspm(nvme0, pcie, aspm): #1:0
     # read lba 0 for 1000 times, interleaved with delays
     read_cmd = SQE(2, 1)
     read_cmd.prp1 = PRPList()
-    pbit = 1
     for i in range(100):
         logging.debug(i)
         slot = i%16
-        if slot == 0:
-            pbit = not pbit
-        next_slot = slot+1
-        if next_slot == 16:
-            next_slot = 0
+        next_slot = (slot+1)%16
         sq[slot] = read_cmd
         sq.tail = next_slot
-        while cq[slot].p == pbit: pass
-        cq.head = next_slot
+        cq.waitdone(update_head=True)
 
         # delay to trigger ASPM
         time.sleep(0.01)
@@ -174,8 +191,9 @@ def test_pcie_cold_reset(subsystem, nvme0, buf):
     nvme0.identify(buf).waitdone()
 
 
-def test_pcie_format(nvme0n1):
+def test_pcie_format(nvme0n1, id_cache):
     nvme0n1.format()
+    id_cache.event("format")
 
     
 def test_pcie_read_bandwidth(nvme0n1):
@@ -186,12 +204,78 @@ def test_pcie_read_bandwidth(nvme0n1):
                          time=1).start().close()
     logging.debug(r)
     logging.info("%dMB/s" % ((io_size*512*r.io_count_read/1000)/1000))
+
+
+def test_pcie_aspm_exit_latency(pcie, nvme0, nvme0n1, qpair):
+    linkcap = pcie.register(capabilities(pcie).offset(0x10)+12, 4)
+    support = (linkcap>>10)&0x3
+    settings = [a for a in (0, 1, 2, 3) if a&support == a]
+    logging.info("ASPM support: %d, L1 exit latency: %s" %
+                 (support, l1_exit_latency(linkcap)))
+
+    result = aspm_latency(pcie, nvme0n1, qpair, settings,
+                          gaps=(0.0001, 0.001, 0.01, 0.1))
+    for r in result:
+        logging.info("ASPM %d, gap %gms: first IO %dus, penalty %dus" %
+                     (r.aspm, r.gap*1000, r.first_io[99]*1000000,
+                      r.penalty*1000000))
+    violations = [(r.aspm, r.gap) for r in result if r.violation]
+    assert not violations, "L1 exit exceeds Link Capabilities: %s" % violations
+
+
+@pytest.fixture()
+def link_speed_restore(pcie, nvme0):
+    # Target Link Speed changed by the test is written back, and the link
+    # is retrained to it when the test leaves it at another speed
+    pciecap = capabilities(pcie).offset(0x10)
+    linkctl2 = pcie.register(pciecap+0x30, 2)
+    speed = pcie.register(pciecap+0x12, 2)&0xf
+    yield
+    if pcie.register(pciecap+0x12, 2)&0xf != speed:
+        retrain(pcie, nvme0, linkctl2&0xf)
+    pcie[pciecap+0x30] = linkctl2&0xff
+
+
+@pytest.mark.parametrize("aspm", [0, 2])
+@pytest.mark.parametrize("lba_random", [False, True])
+@pytest.mark.parametrize("read_percentage", [100, 0])
+@pytest.mark.parametrize("qdepth", [1, 32])
+@pytest.mark.parametrize("io_size", [8, 256])
+@pytest.mark.parametrize("gen", [1, 2, 3, 4, 5])
+def test_pcie_bandwidth_matrix(pcie, nvme0, nvme0n1, id_cache, baseline,
+                               link_speed_restore, pytestconfig, gen,
+                               io_size, qdepth, read_percentage, lba_random, aspm):
+    if not pytestconfig.getoption("pcie_matrix"):
+        pytest.skip("run with --pcie-matrix")
+
+    pciecap = capabilities(pcie).offset(0x10)
+    if gen > pcie.register(pciecap+12, 4)&0xf:
+        pytest.skip("link speed is not supported")
+
+    if pcie.register(pciecap+0x12, 2)&0xf != gen:
+        retrain(pcie, nvme0, gen)
+        if pcie.register(pciecap+0x12, 2)&0xf != gen:
+            pytest.skip("link cannot train to gen %d" % gen)
+
+    lba_size = id_cache.lba_size(nvme0)
+    pcie.aspm = aspm
+    try:
+        mbps = bandwidth(nvme0n1, io_size, qdepth, read_percentage, lba_random,
+                         seconds=2, lba_size=lba_size)
+    finally:
+        pcie.aspm = 0
+
+    key = baseline.key(mn=id_cache.controller(nvme0).mn,
+                       gen=gen, aspm=aspm, io_size=io_size*lba_size,
+                       qdepth=qdepth, read=read_percentage, random=lba_random)
+    logging.info("%s: %dMB/s" % (key, mbps))
+    assert baseline.check(key, mbps), "bandwidth regresses from baseline"
     
 
 @pytest.mark.parametrize("aspm", [0, 2])
 @pytest.mark.parametrize("gen", [1, 2, 3, 2, 1, 1, 2, 3])
 def test_pcie_link_speed(pcie, nvme0, nvme0n1, gen, aspm):
-    linkctr2_addr = pcie.cap_offset(0x10)+0x30
+    linkctr2_addr = capabilities(pcie).offset(0x10)+0x30
     linkctr2 = pcie.register(linkctr2_addr, 4)
     logging.info(linkctr2)
 
@@ -203,9 +287,46 @@ def test_pcie_link_speed(pcie, nvme0, nvme0n1, gen, aspm):
     test_pcie_link_control_aspm(nvme0, pcie, aspm)
     
 
+def test_pcie_link_speed_table(pcie, nvme0, nvme0n1, id_cache):
+    pciecap = capabilities(pcie).offset(0x10)
+    linkcap = pcie.register(pciecap+12, 4)
+    max_speed = linkcap&0xf
+    lba_size = id_cache.lba_size(nvme0)
+
+    # the slot can be slower or narrower than the device, so the link
+    # as trained before the test is the width it can reach
+    linksts = pcie.register(pciecap+0x12, 2)
+    link_width = (linksts>>4)&0x3f
+
+    table = [link_speed(pcie, nvme0, nvme0n1, gen, 2, lba_size)
+             for gen in range(1, max_speed+1)]
+    logging.info("gen  reset(ms)  link up(ms)  ready(ms)  speed  width  loaded  MB/s")
+    for r in table:
+        logging.info("%3d  %9.1f  %11.1f  %9.1f  %5d  %5d  %3d x%-2d  %d" %
+                     (r.target, r.reset_time*1000, r.link_up_time*1000,
+                      r.ready_time*1000, r.speed, r.width,
+                      r.loaded_speed, r.loaded_width, r.mbps))
+
+    # recover the link to the max speed
+    link_speed(pcie, nvme0, nvme0n1, max_speed, 1, lba_size)
+
+    # the highest speed the link trains to, limited by the slot
+    link_speed_max = max([linksts&0xf]+[r.speed for r in table])
+    unreachable = [r.target for r in table if r.target > link_speed_max]
+    if unreachable:
+        logging.info("gen %s is not reachable with the slot at gen %d" %
+                     (unreachable, link_speed_max))
+
+    # links trained down, before or under load
+    down = [r.target for r in table
+            if min(r.speed, r.loaded_speed) < min(r.target, link_speed_max) or
+            min(r.width, r.loaded_width) < link_width]
+    assert not down, "link trains down at gen %s" % down
+
+
 @pytest.mark.parametrize("gen", [5, 4, 0, 3])
 def _test_pcie_link_speed_invalid(pcie, nvme0, nvme0n1, gen):
-    linkctr2_addr = pcie.cap_offset(0x10)+0x30
+    linkctr2_addr = capabilities(pcie).offset(0x10)+0x30
     linkctr2 = pcie.register(linkctr2_addr, 4)
     logging.info(linkctr2)
 
@@ -24,10 +24,13 @@ import logging
 import nvme as d
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
+from config_space import capabilities
+from layout import decode_smart_log
+from bench import d3hot_resume
 
 
 def test_pcie_pmcsr_d3hot(pcie, nvme0, buf):
-    pm_offset = pcie.cap_offset(1)
+    pm_offset = capabilities(pcie).offset(1)
     pmcs = pcie[pm_offset+4]
     logging.info("pmcs %x" % pmcs)
     nvme0.identify(buf).waitdone()
@@ -63,8 +66,8 @@ def test_pcie_pmcsr_d3hot(pcie, nvme0, buf):
     
 def test_pcie_capability_d3hot(pcie, nvme0n1):
     # get pm register
-    assert None != pcie.cap_offset(1)
-    pm_offset = pcie.cap_offset(1)
+    assert None != capabilities(pcie).offset(1)
+    pm_offset = capabilities(pcie).offset(1)
     pmcs = pcie[pm_offset+4]
     assert pcie.power_state == 0
 
@@ -85,6 +88,18 @@ def test_pcie_capability_d3hot(pcie, nvme0n1):
     assert pcie.power_state == 0
     
 
+def test_pcie_d3hot_resume_latency(pcie, nvme0, nvme0n1, qpair, id_cache, cycles=1000):
+    assert pcie.power_state == 0
+    r = d3hot_resume(pcie, nvme0n1, qpair, cycles,
+                     lba_size=id_cache.lba_size(nvme0))
+    assert pcie.power_state == 0
+
+    logging.info("D0 to first IO (us): %s" %
+                 {p: int(l*1000000) for p, l in r.latency.items()})
+    logging.info("failed reads after D0: %d" % r.retries)
+    assert not r.mismatches, "data mismatch in LBA %s" % r.mismatches
+
+
 def test_pcie_aspm_L1(pcie, nvme0, buf):
     #ASPM L1
     pcie.aspm = 2
@@ -132,7 +147,7 @@ def test_pcie_ioworker_aspm(pcie, nvme0, buf):
     def power_cycle_count():
         buf = d.Buffer(4096)
         nvme0.getlogpage(2, buf, 512).waitdone()
-        return buf.data(115, 112)
+        return decode_smart_log(buf).power_cycles
     
     # run the test one by one
     subsystem = d.Subsystem(nvme0)
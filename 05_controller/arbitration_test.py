@@ -23,7 +23,10 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ, IOSQ, SQEBatch
+from arbitration import Trace, wrr_weights, arbitration_burst, URGENT
+from bench import wrr_qos
 
 
 def nvme_init_wrr(nvme0):
@@ -71,11 +74,12 @@ def nvme0n1(nvme0):
     ret.close()
 
 
-def test_ioworker_with_wrr(nvme0, nvme0n1):
+def test_ioworker_with_wrr(nvme0, nvme0n1, id_cache):
     if (nvme0.cap>>17) & 0x1 == 0:
         pytest.skip("WRR is not supported")
 
     nvme0n1.format(512)
+    id_cache.event("format")
 
     # 8:4:2
     assert nvme0[0x14] == 0x00460801
@@ -110,7 +114,24 @@ def test_ioworker_with_wrr(nvme0, nvme0n1):
     assert io_count[0]/io_count[1] < 2.2
 
 
-def test_weighed_round_robin(nvme0):
+@pytest.mark.parametrize("weights", [(8, 4, 2), (16, 4, 1), (2, 2, 2), (64, 8, 1)])
+def test_wrr_qos(nvme0, nvme0n1, weights, tolerance=0.1):
+    if (nvme0.cap>>17) & 0x1 == 0:
+        pytest.skip("WRR is not supported")
+
+    r = wrr_qos(nvme0, nvme0n1, weights)
+    logging.info("%d rounds" % r.rounds)
+    for p, name in ((1, "high"), (2, "medium"), (3, "low")):
+        logging.info("%s: %d IOPS, share %.3f+-%.3f, latency (us) %s" %
+                     (name, r.iops[p], r.share[p], r.share_ci[p], r.latency[p]))
+    logging.info("urgent latency (us): %s" % r.urgent_latency)
+
+    # share of IOPS follows the weights
+    for p, weight in zip((1, 2, 3), weights):
+        assert abs(r.share[p]-weight/sum(weights)) < tolerance
+
+
+def test_weighed_round_robin(nvme0, tolerance=0.1):
     if (nvme0.cap>>17) & 0x1 == 0:
         pytest.skip("WRR is not supported")
 
@@ -126,14 +147,15 @@ def test_weighed_round_robin(nvme0):
     # create the senario of Figure 138 in NVMe spec v1.4
     # 1 admin, 2 urgent, 2 high, 2 medium, 2 low
     sq_list = []
+    qprio = {i+1: i//2 for i in range(8)}
     cq = IOCQ(nvme0, 1, 1024, PRP(1024*64))
-    for i in range(8):
-        sq_list.append(IOSQ(nvme0, i+1, 128, PRP(128*64), cqid=1, qprio=i//2))
+    for sqid, prio in qprio.items():
+        sq_list.append(IOSQ(nvme0, sqid, 128, PRP(128*64), cqid=1, qprio=prio))
 
     # fill 100 flush commands in each queue
+    flush_batch = SQEBatch(100, opcode=0, nsid=1).cid(0)
     for sq in sq_list:
-        for i in range(100):
-            sq[i] = SQE(i<<16+0, 1)
+        sq.put(flush_batch)
 
     # fire all sq, low prio first
     for sq in sq_list[::-1]:
@@ -146,12 +168,24 @@ def test_weighed_round_robin(nvme0):
 
     # check sqid of the whole cq
     time.sleep(3)
-    logging.info([cq[i][2]>>16 for i in range(100*8)])
+    trace = Trace(cq.snapshot(count=100*8)["sqid"])
+    logging.info(trace.sqids.tolist())
+
     # assert all urgent IO completed first
-    last_sqid = {cq[i][2]>>16 for i in range(300, 800)}
-    logging.debug(last_sqid)
-    assert 1 not in last_sqid
-    assert 2 not in last_sqid
+    urgent_end = max(trace.served(1)[-1], trace.served(2)[-1])+1
+    logging.info("urgent IO completed in %d completions" % urgent_end)
+    assert urgent_end <= 300
+
+    # share of high, medium and low queues follows the weights
+    weights = wrr_weights(cdw0, {sqid: prio for sqid, prio in qprio.items()
+                                 if prio != URGENT})
+    fairness = trace.fairness(weights, start=urgent_end,
+                              burst=arbitration_burst(cdw0))
+    logging.info("share: %s, expected: %s" % (fairness.share, fairness.expected))
+    logging.info("max burst: %s, arbitration burst: %s" %
+                 ({q: int(b.max()) for q, b in trace.bursts().items()},
+                  arbitration_burst(cdw0)))
+    assert fairness.mean_deviation < tolerance
 
     # delete all queues
     for sq in sq_list:
@@ -159,7 +193,7 @@ def test_weighed_round_robin(nvme0):
     cq.delete()
 
 
-def test_default_round_robin(nvme0):
+def test_default_round_robin(nvme0, tolerance=0.1):
     if (nvme0.cap & 0xffff) + 1 < 1024:
         pytest.skip("cq depth is not enough")
     
@@ -170,9 +204,9 @@ def test_default_round_robin(nvme0):
         sq_list.append(IOSQ(nvme0, i+1, 128, PRP(128*64), cqid=1))
 
     # fill 100 flush commands in each queue
+    flush_batch = SQEBatch(100, opcode=0, nsid=1).cid(0)
     for sq in sq_list:
-        for i in range(100):
-            sq[i] = SQE(i<<16+0, 1)
+        sq.put(flush_batch)
 
     # fire all sq, low prio first
     for sq in sq_list:
@@ -185,10 +219,16 @@ def test_default_round_robin(nvme0):
 
     # check sqid of the whole cq
     time.sleep(3)
-    logging.info([cq[i][2]>>16 for i in range(100*8)])
-    # assert all urgent IO completed first
-    last_sqid = {cq[i][2]>>16 for i in range(700, 800)}
-    assert len(last_sqid) >= 7
+    trace = Trace(cq.snapshot(count=100*8)["sqid"])
+    logging.info(trace.sqids.tolist())
+
+    # all queues share the service equally, in bursts of the arbiter
+    burst = arbitration_burst(nvme0.getfeatures(1).waitdone())
+    fairness = trace.fairness({sqid: 1 for sqid in range(1, 9)}, burst=burst)
+    logging.info("share: %s" % fairness.share)
+    logging.info("burst distribution: %s" %
+                 {q: d.tolist() for q, d in trace.burst_distribution().items()})
+    assert fairness.mean_deviation < tolerance
 
     # delete all queues
     for sq in sq_list:
@@ -23,6 +23,8 @@ import pytest
 import logging
 
 import nvme as d
+from config_space import capabilities
+from bench import coalescing_sweep, completion_mode, COMPLETION_MODES
 
 
 @pytest.fixture(scope="function")
@@ -66,6 +68,32 @@ def test_io_qpair_msix_interrupt_all(nvme0, nvme0n1, ncqa):
         q.delete()
 
 
+def test_io_qpair_completion_modes(pcie, nvme0, nvme0n1, ncqa):
+    # a vector for each qpair, vector 0 is of the admin CQ
+    msix_ctrl = pcie.register(capabilities(pcie).offset(0x11)+2, 2)
+    max_qcount = min(ncqa, msix_ctrl&0x7ff)
+
+    # qpair count 1, 2, 4, ... up to the max
+    qcounts = [1<<i for i in range(16) if 1<<i < max_qcount]+[max_qcount]
+    logging.info("qpairs  mode  IOPS  latency p50/p99(us)  cpu/IO(us)")
+    for qcount in qcounts:
+        result = {}
+        for mode in COMPLETION_MODES:
+            r = completion_mode(nvme0, nvme0n1, qcount, mode, seconds=2)
+            logging.info("%6d  %4s  %5d  %d/%d  %.1f" %
+                         (qcount, mode, r.iops, r.latency[50]*1000000,
+                          r.latency[99]*1000000, r.cpu_per_io*1000000))
+            result[mode] = r
+
+            # every IO submitted is completed successfully
+            assert r.io_count > 0
+            assert r.errors == 0
+        logging.info("qpairs %d: irq costs %.0f%% cpu, at %.0f%% IOPS of poll" %
+                     (qcount,
+                      100*result["irq"].cpu_per_io/result["poll"].cpu_per_io-100,
+                      100*result["irq"].iops/result["poll"].iops))
+
+
 def test_io_qpair_msix_interrupt_mask(nvme0, nvme0n1, buf):
     q = d.Qpair(nvme0, 8)
 
@@ -160,8 +188,36 @@ def test_io_qpair_msix_interrupt_coalescing(nvme0, nvme0n1, buf, qpair):
     assert latency2 > latency1
 
 
+def test_io_qpair_msix_interrupt_coalescing_sweep(nvme0, nvme0n1, qpair,
+                                                  tolerance=0.02):
+    result = coalescing_sweep(nvme0, nvme0n1, qpair,
+                              times=[0, 1, 5, 20], thresholds=[0, 3, 7, 15])
+    logging.info("time(us)  threshold  CD  irq/IO  IOPS  latency p50/p99(us)")
+    for r in result:
+        logging.info("%8d  %9d  %2d  %6.3f  %5d  %d/%d" %
+                     (r.aggregation_time*100, r.threshold+1, r.disabled,
+                      r.interrupts_per_io, r.iops,
+                      r.latency[50]*1000000, r.latency[99]*1000000))
+
+    # coalescing off, and the most aggregation
+    enabled = {(r.aggregation_time, r.threshold): r
+               for r in result if not r.disabled}
+    off = enabled[(0, 0)].interrupts_per_io
+    most = enabled[(20, 15)].interrupts_per_io
+
+    # aggregation time or threshold lowers the interrupts per IO
+    assert most < off
+    for r in enabled.values():
+        assert r.interrupts_per_io <= off+tolerance
+
+    # CD of the vector: no setting aggregates its interrupts
+    for r in result:
+        if r.disabled:
+            assert r.interrupts_per_io > most
+
+
 def test_pcie_msix_cap_disable_ctrl(pcie, nvme0, nvme0n1, buf, qpair):
-    msix_cap_addr = pcie.cap_offset(0x11)
+    msix_cap_addr = capabilities(pcie).offset(0x11)
     msix_ctrl = pcie.register(msix_cap_addr+2, 2)
     logging.info("msix_ctrl register [0x%x]= 0x%x" %
                  (msix_cap_addr+2, msix_ctrl))
@@ -24,7 +24,8 @@ import logging
 import nvme as d
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
 
 
 def test_create_cq_with_invalid_prp_offset(nvme0):
@@ -100,41 +101,22 @@ def test_hello_world(nvme0, nvme0n1, repeat):
     assert read_buf[10:21] == b'hello world'
 
 
-def test_format_512(nvme0n1):
+def test_format_512(nvme0n1, id_cache):
     nvme0n1.format(512)
+    id_cache.event("format")
 
 
 @pytest.mark.parametrize("mdts", [64, 128, 256, 512, 800, 1024, 16*1024, 32*1024, 32*1024+64, 32*1024+64+8,64*1024])
-def test_write_mdts(nvme0, mdts):
+def test_write_mdts(nvme0, mdts, prp_chains):
     cq = IOCQ(nvme0, 1, 2, PRP())
     sq = IOSQ(nvme0, 1, 2, PRP(), cqid=1)
 
     # prp for the long buffer
-    write_buf_1 = PRP(ptype=32, pvalue=0xaaaaaaaa)
-    pages = mdts//8
-    pages -= 1
-
-    prp_list = PRPList()
-    prp_list_head = prp_list
-    while pages:
-        for i in range(511):
-            if pages:
-                prp_list[i] = PRP()
-                pages -= 1
-                logging.debug(pages)
-        if pages>1:
-            tmp = PRPList()
-            prp_list[511] = tmp
-            prp_list = tmp
-            logging.debug("prp_list")
-        elif pages==1:
-            prp_list[511] = PRP()
-            pages -= 1
-            logging.debug(pages)
+    chain = prp_chains.get(nvme0, mdts*512, ptype=32, pvalue=0xaaaaaaaa)
+    logging.debug("%d pages" % len(chain))
 
     w1 = SQE(1, 1)
-    w1.prp1 = write_buf_1
-    w1.prp2 = prp_list_head
+    chain.fill(w1)
     w1[12] = mdts-1 # 0based, nlba
     w1.cid = 0x123
     sq[0] = w1
@@ -238,7 +220,7 @@ def test_valid_offset_prp_in_list(nvme0):
     sq[0] = cmd
     logging.info(sq[0])
     sq.tail = 1
-    while CQE(cq[0]).p == 0: pass
+    cq.waitdone()
     cq.head = 1
     logging.info(cq[0])
     logging.info(hex(cq[0][3]>>17))
@@ -278,7 +260,7 @@ def test_invalid_offset_prp_in_list(nvme0):
     sq[0] = cmd
     logging.info(sq[0])
     sq.tail = 1
-    while CQE(cq[0]).p == 0: pass
+    cq.waitdone()
     cq.head = 1
     logging.info(cq[0])
     logging.info(hex(cq[0][3]>>17))
@@ -292,3 +274,26 @@ def test_invalid_offset_prp_in_list(nvme0):
     cq.delete()
 
 
+
+@pytest.mark.parametrize("index", [1, 2, -1])
+def test_invalid_offset_prp_in_chain(nvme0, index, prp_chains):
+    cq = IOCQ(nvme0, 1, 10, PRP())
+    sq = IOSQ(nvme0, 1, 10, PRP(), cqid=1)
+
+    # prp for mdts, and one entry in the prp lists has non-zero offset
+    chain = prp_chains.get(nvme0, nvme0.mdts)
+    index = index%len(chain)
+    chain.set_entry(index, chain.prp1+index*chain.page_size+0x10)
+
+    cmd = SQE(2, 1)
+    chain.fill(cmd)
+    cmd[12] = nvme0.mdts//512-1
+    sq[0] = cmd
+    sq.tail = 1
+    cqe = cq.waitdone()[0]
+    cq.head = 1
+    status = ((cqe.sct<<8)|cqe.sc)&0x3ff
+    assert status == 0x0013 or status == 0
+
+    sq.delete()
+    cq.delete()
@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ, IOSQ as BatchIOSQ, SQEBatch
 
 
 def test_sq_cq_around(nvme0):
@@ -58,6 +59,44 @@ def test_sq_cq_around(nvme0):
     cq.delete()
 
 
+@pytest.mark.parametrize("strategy", ["spin", "yield", "backoff"])
+def test_cq_waitdone_around(nvme0, strategy):
+    cq = IOCQ(nvme0, 1, 3, PRP())
+    sq = IOSQ(nvme0, 1, 5, PRP(), cqid=1)
+
+    # 3 passes of the cq, the phase tag inverts on each pass
+    for i in range(9):
+        sq[i%5] = SQE((i<<16)+0, 1)
+        sq.tail = (i+1)%5
+        cqe = cq.waitdone(strategy=strategy, update_head=True)[0]
+        assert cqe.cid == i
+        assert cqe.sqhd == (i+1)%5
+        assert cqe.phase == (i//3+1)%2
+    assert cq.phase == 0
+
+    sq.delete()
+    cq.delete()
+
+
+def test_sq_batch_around(nvme0):
+    qsize = min(1024, 1+(nvme0.cap&0xffff))
+    cq = IOCQ(nvme0, 1, qsize, PRP(qsize*16))
+    sq = BatchIOSQ(nvme0, 1, qsize, PRP(qsize*64), cqid=1)
+
+    # 10 passes of the sq with flush commands, not aligned to the sq size
+    batch = SQEBatch(qsize//2+1, opcode=0, nsid=1)
+    tail = 0
+    for i in range(20):
+        tail = sq.put(batch.cid(i*len(batch)), tail)
+        sq.tail = tail
+        cqe_list = cq.waitdone(len(batch), update_head=True)
+        assert sorted(c.cid for c in cqe_list) == \
+            [(i*len(batch)+j)&0xffff for j in range(len(batch))]
+
+    sq.delete()
+    cq.delete()
+
+
 def test_sq_overflow(nvme0):
     cq = IOCQ(nvme0, 1, 5, PRP())
     sq = IOSQ(nvme0, 1, 2, PRP(), cqid=1)
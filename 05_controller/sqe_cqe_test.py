@@ -23,7 +23,8 @@ import pytest
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem
-from scripts.psd import IOCQ, IOSQ, PRP, PRPList, SQE, CQE
+from scripts.psd import IOSQ, PRP, PRPList, SQE, CQE
+from raw_queue import IOCQ
 
 
 def test_cq_p_phase_bit(nvme0):
@@ -131,8 +132,7 @@ def test_p_invert_after_cq_2_pass(nvme0):
 
     logging.info("aaa")
     # cqe for w1
-    while CQE(cq[0]).p == 0: pass
-    cqe = CQE(cq[0])
+    cqe = cq.waitdone()[0]
     assert cqe.cid == 0x123
     assert cqe.sqid == 3
     assert cqe.sqhd == 1
@@ -140,9 +140,8 @@ def test_p_invert_after_cq_2_pass(nvme0):
 
     # cqe for w2
     logging.info("bbb")
-    while CQE(cq[1]).p == 0: pass
+    cqe = cq.waitdone()[0]
     logging.info("ccc")
-    cqe = CQE(cq[1])
     assert cqe.cid == 0x567
     assert cqe.sqid == 3
     assert cqe.sqhd == 2
@@ -165,16 +164,14 @@ def test_p_invert_after_cq_2_pass(nvme0):
     sq3.tail = 4
 
     # cqe for w3
-    while CQE(cq[0]).p == 1: pass
-    cqe = CQE(cq[0])
+    cqe = cq.waitdone()[0]
     assert cqe.cid == 0x147
     assert cqe.sqid == 3
     assert cqe.sqhd == 3
     cq.head = 1
 
     # cqe for w4
-    while CQE(cq[1]).p == 1: pass
-    cqe = CQE(cq[1])
+    cqe = cq.waitdone()[0]
     assert cqe.cid == 0x167
     assert cqe.sqid == 3
     assert cqe.sqhd == 4
@@ -216,39 +213,19 @@ def test_sq_cid2(nvme0):
     cq.delete()
 
     
-def test_cid_conflict(nvme0):
+def test_cid_conflict(nvme0, prp_chains):
     mdts_lba = nvme0.mdts//512
     cq = IOCQ(nvme0, 1, 20, PRP())
     sq = IOSQ(nvme0, 1, 20, PRP(), cqid=1)
 
-    # prp for the long buffer
-    write_buf_1 = PRP(ptype=32, pvalue=0xaaaaaaaa)
-    pages = mdts_lba//8
-    pages -= 1
-
-    prp_list = PRPList()
-    prp_list_head = prp_list
-    while pages:
-        logging.info(pages)
-        for i in range(63):
-            if pages:
-                prp_list[i] = PRP()
-                pages -= 1
-                logging.debug(pages)
-        if pages>1:
-            tmp = PRPList()
-            prp_list[63] = tmp
-            prp_list = tmp
-            logging.debug("prp_list")
-        elif pages==1:
-            prp_list[63] = PRP()
-            pages -= 1
-            logging.debug(pages)
+    # prp for the long buffer, 64 entries in each prp list
+    chain = prp_chains.get(nvme0, mdts_lba*512, list_entries=64,
+                            ptype=32, pvalue=0xaaaaaaaa)
+    logging.info("%d pages" % len(chain))
 
     #send first cmd   
     w1 = SQE((1<<16)+1, 1)
-    w1.prp1 = write_buf_1
-    w1.prp2 = prp_list_head
+    chain.fill(w1)
     w1[12] = mdts_lba-1 # 0based, nlba
     sq[0] = w1
     sq[1] = w1
@@ -35,12 +35,15 @@
 
 
 import time
+import contextlib
 import pytest
 import random
 import logging
 
 from nvme import Controller, Namespace, Buffer, Qpair, Pcie, Subsystem, __version__
 from scripts.zns import Zone
+from dma import parse
+from layout import ZONE_REPORT_HEADER, ZONE_DESCRIPTOR
 
 
 skip_zns = True  # False
@@ -60,17 +63,15 @@ def test_zns_support(nvme0):
 # Zone Descriptor Extension Size bit 71:64 (ZDES)
 # Zone Size 63:0 (ZSZE)
 @pytest.fixture( )
-def zone_desctr_size(nvme0, buf):
-    nvme0.identify(buf, nsid=1, cns=5, csi=2).waitdone()
-    ret = buf.data(2832, 2832)
+def zone_desctr_size(nvme0, id_cache):
+    ret = id_cache.id_data(nvme0, 2832, nsid=1, cns=5, csi=2)
     logging.debug("ZDES: 0x%x" % ret) 
     return ret
 
 
 @pytest.fixture( )
-def zone_size(nvme0, buf):
-    nvme0.identify(buf, nsid=1, cns=5, csi=2).waitdone()
-    ret = buf.data(2831, 2816)
+def zone_size(nvme0, id_cache):
+    ret = id_cache.id_data(nvme0, 2831, 2816, nsid=1, cns=5, csi=2)
     logging.debug("zone size: 0x%x" % ret)
     if ret == 0:
         ret = 0x8000
@@ -80,7 +81,7 @@ def zone_size(nvme0, buf):
 @pytest.fixture( )
 def num_of_zones(nvme0n1, qpair, buf):
     nvme0n1.zns_mgmt_receive(qpair, buf).waitdone()
-    ret = buf.data(7, 0)
+    ret = int(parse(buf, ZONE_REPORT_HEADER)["nr_zones"])
     return ret
 
 
@@ -153,15 +154,14 @@ def test_zns_management_receive(nvme0, nvme0n1, qpair, buf, zone_size, num_of_zo
     logging.info("zone size: 0x%x" % zone_size)
 
     for i in range(num_of_zones):
-        base = 64
         nvme0n1.zns_mgmt_receive(qpair, buf, slba=i*zone_size).waitdone()
-        zone_type = buf.data(base)
-        assert zone_type == 2
+        desc = parse(buf, ZONE_DESCRIPTOR, 64)
+        assert desc["zt"] == 2
 
         zone = Zone(qpair, nvme0n1, i*zone_size)
         assert zone.capacity <= zone_size
-        #assert buf.data(base+1)>>4 == 14
-        assert buf.data(base+15, base+8) == zone.capacity
+        #assert desc["zs"]>>4 == 14
+        assert desc["zcap"] == zone.capacity
         logging.info(zone)
  
 
@@ -420,20 +420,23 @@ def test_zns_write_to_full(nvme0, nvme0n1, qpair, zone, io_counter=768):
     
         
 @pytest.mark.parametrize("io_counter", [1, 2, 10, 39, 100, 255])
-def test_zns_write_and_read_multiple(nvme0, nvme0n1, qpair, zone, io_counter,buf):
-    buf_list = [Buffer(96*1024) for i in range(io_counter)]
-    for i in range(io_counter):
-        buf_list[i][8] = i
-        zone.write(qpair, buf_list[i], i*16, 16).waitdone()
+def test_zns_write_and_read_multiple(nvme0, nvme0n1, qpair, zone, io_counter, buffer_pool):
+    # all write buffers go back to the pool, even when the test fails
+    with contextlib.ExitStack() as stack:
+        buf_list = [stack.enter_context(buffer_pool.buffer(96*1024))
+                    for i in range(io_counter)]
+        for i in range(io_counter):
+            buf_list[i][8] = i
+            zone.write(qpair, buf_list[i], i*16, 16).waitdone()
     zone.close()
     zone.finish()
     assert zone.state == 'Full'
     
     for i in range(io_counter):
-        buf = Buffer(96*1024)
-        zone.read(qpair, buf, i*16, 16).waitdone()
-        logging.debug(buf.dump(16))
-        assert buf[8] == i
+        with buffer_pool.buffer(96*1024) as buf:
+            zone.read(qpair, buf, i*16, 16).waitdone()
+            logging.debug(buf.dump(16))
+            assert buf[8] == i
         
 
 def test_zns_ioworker_baisc(zone, zone_size):
@@ -541,17 +544,15 @@ def test_iocmd_set_profile(nvme0, nvme0n1, qpair, buf):
     cdw0 = nvme0.getfeatures(7).waitdone()
     logging.info("Number of Queue:0x%x" % cdw0)
 
-def test_zone_info(nvme0, buf):
-    nvme0.identify(buf, nsid=1, cns=5, csi=2).waitdone()
-    mar = buf.data(7, 4)
-    logging.info("Maximum Active Resources (MAR): 0x%x" % mar)
-    mor = buf.data(11, 8)
-    logging.info("Maximum Open Resources (MAR): 0x%x" % mor)
+def test_zone_info(nvme0, id_cache):
+    id_zns = id_cache.zns_namespace(nvme0)
+    logging.info("Maximum Active Resources (MAR): 0x%x" % id_zns.mar)
+    logging.info("Maximum Open Resources (MAR): 0x%x" % id_zns.mor)
+    logging.info("Zone Size (ZSZE): 0x%x" % id_zns.lbafe[0].zsze)
 
 
-def test_max_open_zone(nvme0, nvme0n1, qpair, buf, zone_size, num_of_zones, zslba_list):
-    nvme0.identify(buf, nsid=1, cns=5, csi=2).waitdone()
-    mor = buf.data(11, 8)
+def test_max_open_zone(nvme0, nvme0n1, qpair, buf, zone_size, num_of_zones, zslba_list, id_cache):
+    mor = id_cache.id_data(nvme0, 11, 8, nsid=1, cns=5, csi=2)
     logging.info("Maximum Open Resources (MAR): 0x%x" % mor)
 
     if (mor == 0xffffffff):
@@ -0,0 +1,87 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import pytest
+import logging
+
+from bench import raw_io, doorbell_policy
+from raw_queue import DoorbellBuffer, Doorbell
+
+
+@pytest.mark.parametrize("opcode", [2, 1])
+@pytest.mark.parametrize("qcount", [1, 2, 4])
+@pytest.mark.parametrize("qdepth", [2, 16, 128])
+def test_raw_iops(nvme0, nvme0n1, opcode, qcount, qdepth):
+    if qdepth > 1+(nvme0.cap&0xffff):
+        pytest.skip("mqes is not enough")
+
+    r = raw_io(nvme0, opcode, qcount, qdepth, seconds=5)
+    logging.info("%s qcount %d, qdepth %d: %d IOPS, %.1fus cpu/IO" %
+                 ("read" if opcode==2 else "write", qcount, qdepth,
+                  r.iops, r.cpu_per_io*1000000))
+    logging.info("latency of batch (us): %s" %
+                 {p: int(l*1000000) for p, l in r.latency.items()})
+    assert r.errors == 0
+
+
+@pytest.mark.parametrize("batch", [1, 8, 32, 127])
+def test_raw_iops_batch(nvme0, nvme0n1, batch):
+    if 1+(nvme0.cap&0xffff) < 128:
+        pytest.skip("mqes is not enough")
+
+    r = raw_io(nvme0, 2, qdepth=128, batch=batch, seconds=5)
+    logging.info("batch %d: %d IOPS, %.1fus cpu/IO" %
+                 (batch, r.iops, r.cpu_per_io*1000000))
+    assert r.errors == 0
+
+
+@pytest.mark.parametrize("shadow", [False, True])
+def test_raw_iops_shadow_doorbell(nvme0, nvme0n1, id_cache, shadow):
+    if shadow and not id_cache.controller(nvme0).oacs & 0x100:
+        pytest.skip("doorbell buffer config is not supported")
+
+    dbbuf = DoorbellBuffer(nvme0) if shadow else None
+    try:
+        r = raw_io(nvme0, 2, qdepth=64, batch=8, seconds=5, dbbuf=dbbuf)
+    finally:
+        if shadow:
+            # only reset clears the shadow doorbells of the controller
+            nvme0.reset()
+    logging.info("shadow doorbell %s: %d IOPS, %.2f MMIO writes/IO" %
+                 (shadow, r.iops, r.mmio_writes/r.io_count))
+    assert r.errors == 0
+
+
+@pytest.mark.parametrize("doorbell", [Doorbell("immediate"),
+                                      Doorbell("every", 4),
+                                      Doorbell("every", 16),
+                                      Doorbell("timed", interval=0.00002),
+                                      Doorbell("timed", interval=0.0001),
+                                      Doorbell("flush")], ids=repr)
+def test_raw_iops_doorbell_policy(nvme0, nvme0n1, doorbell):
+    if 1+(nvme0.cap&0xffff) < 64:
+        pytest.skip("mqes is not enough")
+
+    r = doorbell_policy(nvme0, doorbell, qdepth=64, seconds=5)
+    logging.info("%s: %d IOPS, %.2f SQ and %.2f CQ doorbell writes/IO" %
+                 (doorbell, r.iops, r.sq_writes, r.cq_writes))
+    logging.info("latency of command (us): %s" %
+                 {p: int(l*1000000) for p, l in r.latency.items()})
+    assert r.errors == 0
@@ -0,0 +1,148 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import logging
+import collections
+import numpy as np
+
+
+# qprio of IO SQs in weighted round robin
+URGENT = 0
+HIGH = 1
+MEDIUM = 2
+LOW = 3
+
+
+def arbitration_burst(cdw0):
+    """commands fetched from a SQ at a time, of feature 0x01
+
+    None for no limit.
+    """
+
+    ab = cdw0&0x7
+    return None if ab == 7 else 1<<ab
+
+
+def wrr_weights(cdw0, qprio):
+    """weights of SQs by their qprio, of feature 0x01
+
+    qprio: dict of sqid to its priority, HIGH, MEDIUM or LOW
+    return: dict of sqid to the weight, LPW/MPW/HPW plus 1
+    """
+
+    shift = {HIGH: 24, MEDIUM: 16, LOW: 8}
+    return {sqid: ((cdw0>>shift[p])&0xff)+1 for sqid, p in qprio.items()}
+
+
+Fairness = collections.namedtuple("Fairness", [
+    "start", "end", "share", "expected", "mean_deviation", "max_deviation"])
+
+
+class Trace(object):
+    """completion sequence of a shared IOCQ, by the sqid of each CQE
+
+    sqids: sqid of the completions in order, e.g. cq.snapshot()["sqid"]
+    """
+
+    def __init__(self, sqids):
+        self.sqids = np.asarray(sqids)
+
+    def __len__(self):
+        return len(self.sqids)
+
+    def queues(self):
+        return np.unique(self.sqids).tolist()
+
+    def served(self, sqid):
+        """index of the completions of the SQ"""
+        return np.flatnonzero(self.sqids == sqid)
+
+    def contended(self, queues):
+        """end of the completions where all the queues are backlogged,
+        when the first of them is drained"""
+        return min(self.served(q)[-1] for q in queues)+1
+
+    def share(self, queues, window, step=1, start=0, end=None):
+        """service share of the queues in sliding windows
+
+        return: start index of the windows, and the share of each queue
+                in each window, an array of (windows, queues)
+        """
+
+        if end is None:
+            end = len(self.sqids)
+        sqids = self.sqids[start:end]
+        onehot = (sqids[:, None] == np.asarray(queues)[None, :])
+        counts = np.vstack([np.zeros((1, len(queues)), dtype=int),
+                            np.cumsum(onehot, axis=0)])
+        starts = np.arange(0, len(sqids)-window+1, step)
+        return starts+start, (counts[starts+window]-counts[starts])/window
+
+    def bursts(self):
+        """lengths of the runs of consecutive completions, by sqid"""
+
+        edges = np.flatnonzero(np.diff(self.sqids))+1
+        begin = np.concatenate([[0], edges])
+        length = np.diff(np.concatenate([begin, [len(self.sqids)]]))
+        return {q: length[self.sqids[begin] == q] for q in self.queues()}
+
+    def burst_distribution(self):
+        """histogram of the burst lengths, by sqid"""
+        return {q: np.bincount(b) for q, b in self.bursts().items()}
+
+    def fairness(self, weights, window=None, start=0, end=None, burst=1):
+        """deviation of the service share from the weights of the queues
+
+        Only the completions from start to the end of contention of the
+        queues are measured, where the arbiter has to share the service.
+
+        weights: dict of sqid to its weight, e.g. from wrr_weights()
+        window: completions in a window, 4 rounds of the weights by default
+        burst: arbitration burst of the controller, which scales a round,
+               None for no limit, where the window is the whole region
+        return: Fairness, the share of each queue over all the region, the
+                expected share, and the mean and max over the windows of
+                the largest deviation of a queue
+        """
+
+        queues = sorted(weights)
+        if end is None:
+            end = self.contended(queues)
+        total = sum(weights.values())
+        if window is None:
+            window = end-start if burst is None else 4*total*burst
+        expected = np.array([weights[q]/total for q in queues])
+
+        region = self.sqids[start:end]
+        served = np.array([np.count_nonzero(region == q) for q in queues])
+        share = served/max(served.sum(), 1)
+
+        window = min(window, end-start)
+        starts, shares = self.share(queues, window, max(1, window//4),
+                                    start, end)
+        deviation = np.abs(shares/np.maximum(shares.sum(axis=1), 1e-9)[:, None]
+                           - expected).max(axis=1)
+        ret = Fairness(start, end,
+                       dict(zip(queues, share.tolist())),
+                       dict(zip(queues, expected.tolist())),
+                       float(deviation.mean()) if len(deviation) else 0.0,
+                       float(deviation.max()) if len(deviation) else 0.0)
+        logging.info(ret)
+        return ret
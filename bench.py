@@ -0,0 +1,908 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import json
+import time
+import logging
+import warnings
+import collections
+import numpy as np
+
+from nvme import Buffer, Qpair
+from scripts.psd import PRP
+from raw_queue import IOCQ, IOSQ, SQEBatch, pause, BACKOFF_MIN
+from config_space import capabilities
+from dma import fill, verify_pattern
+
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentiles(samples, pcts=PERCENTILES):
+    """percentiles of the samples, in a dict keyed by the percentile"""
+    if len(samples) == 0:
+        return dict.fromkeys(pcts, 0.0)
+    return dict(zip(pcts, np.percentile(samples, pcts).tolist()))
+
+
+class Timer(object):
+    """wall clock time and host cpu time spent in the with block"""
+
+    def __enter__(self):
+        self.wall = self.cpu = 0.0
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter()-self._wall
+        self.cpu = time.process_time()-self._cpu
+
+
+RawIOResult = collections.namedtuple("RawIOResult", [
+    "io_count", "seconds", "iops", "cpu_per_io", "latency", "errors",
+    "mmio_writes"])
+
+
+def raw_io(nvme0, opcode=2, qcount=1, qdepth=64, batch=None,
+           io_size=8, seconds=1, nsid=1, dbbuf=None):
+    """drive pre-built rings of raw IOSQ/IOCQ, bypassing ioworker
+
+    Every ring is filled with commands once. Each round advances the tail
+    doorbell of all queues by batch entries, and reaps the same number of
+    completions from each IOCQ by the phase tag. The reaped entries are
+    decoded to count the ones with error status.
+
+    opcode: 2 for read, 1 for write
+    io_size: lba count of each command, data fits in one 4K page
+    dbbuf: DoorbellBuffer to ring the doorbells through its shadow buffer
+    return: RawIOResult, latency is the percentiles of rounds in seconds,
+            mmio_writes is the doorbell registers written in the rounds
+    """
+
+    assert io_size <= 8
+    if batch is None:
+        batch = qdepth-1
+    assert 0 < batch < qdepth
+
+    queues = []
+    for qid in range(1, qcount+1):
+        cq = IOCQ(nvme0, qid, qdepth, PRP(qdepth*16), dbbuf=dbbuf)
+        sq = IOSQ(nvme0, qid, qdepth, PRP(qdepth*64), cqid=qid, dbbuf=dbbuf)
+        cmds = SQEBatch(qdepth, opcode, nsid).cid(0).nlb(io_size-1)
+        cmds.slba((qid-1)*qdepth*io_size, io_size).prp1([PRP()])
+        sq.put(cmds)
+        queues.append((cq, sq))
+
+    tail = 0
+    latency = []
+    io_count = 0
+    errors = 0
+    with Timer() as t:
+        deadline = time.perf_counter()+seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            tail = (tail+batch)%qdepth
+            for cq, sq in queues:
+                sq.tail = tail
+            for cq, sq in queues:
+                slot = cq.reap(batch, update_head=True)
+                cqe = cq._entries((slot-batch)%qdepth, batch)
+                errors += int(np.count_nonzero(cqe["sc"]|cqe["sct"]))
+            latency.append(time.perf_counter()-start)
+            io_count += batch*qcount
+
+    mmio_writes = 0
+    for cq, sq in queues:
+        mmio_writes += sq.mmio_writes+cq.mmio_writes
+        sq.delete()
+        cq.delete()
+
+    ret = RawIOResult(io_count, t.wall, io_count/t.wall,
+                      t.cpu/max(io_count, 1), percentiles(latency), errors,
+                      mmio_writes)
+    logging.info(ret)
+    return ret
+
+
+def timed(cmd, *args, **kwargs):
+    """seconds from sending the command to its completion"""
+
+    start = time.perf_counter()
+    cmd(*args, **kwargs).waitdone()
+    return time.perf_counter()-start
+
+
+PowerStateLatency = collections.namedtuple("PowerStateLatency", [
+    "ps_from", "ps_to", "transition", "first_io",
+    "transition_limit", "first_io_limit", "violation"])
+
+
+def power_state_latency(nvme0, nvme0n1, qpair, psd, repeat=100, lba=0,
+                        tolerance=0.00005):
+    """latency matrix of transitions between the power states in psd
+
+    For every pair, the controller is set to ps_from, then the completion
+    time of setfeatures(0x02) to ps_to and the latency of the first read
+    after it are measured repeat times.
+
+    The host overhead is the 99th percentile of a setfeatures without
+    transition and of a read in PS0. It is deducted from the 99th
+    percentile of the pair, which is compared with the limits from the
+    power state descriptors, plus tolerance seconds of jitter:
+    transition: EXLAT of ps_from plus ENLAT of ps_to
+    first IO: ENLAT plus EXLAT of ps_to, the read may arrive in entering
+
+    psd: power state descriptor records of identify controller
+    return: list of PowerStateLatency, percentiles and limits in seconds
+    """
+
+    buf = Buffer(512)
+    orig_ps = nvme0.getfeatures(0x2).waitdone()
+
+    nvme0.setfeatures(0x2, cdw11=0).waitdone()
+    setfeatures_base = percentiles([timed(nvme0.setfeatures, 0x2, cdw11=0)
+                                    for i in range(repeat)])[99]
+    read_base = percentiles([timed(nvme0n1.read, qpair, buf, lba)
+                             for i in range(repeat)])[99]
+    logging.info("host overhead: setfeatures %dus, read %dus" %
+                 (setfeatures_base*1000000, read_base*1000000))
+
+    ret = []
+    for ps_from in range(len(psd)):
+        for ps_to in range(len(psd)):
+            transition = []
+            first_io = []
+            settle = (psd[ps_from].enlat+psd[ps_from].exlat)/1000000
+            for i in range(repeat):
+                nvme0.setfeatures(0x2, cdw11=ps_from).waitdone()
+                time.sleep(settle)
+                transition.append(timed(nvme0.setfeatures, 0x2, cdw11=ps_to))
+                first_io.append(timed(nvme0n1.read, qpair, buf, lba))
+
+            r = PowerStateLatency(
+                ps_from, ps_to,
+                percentiles(transition), percentiles(first_io),
+                (psd[ps_from].exlat+psd[ps_to].enlat)/1000000,
+                (psd[ps_to].enlat+psd[ps_to].exlat)/1000000,
+                False)
+            violation = \
+                r.transition[99]-setfeatures_base > r.transition_limit+tolerance or \
+                r.first_io[99]-read_base > r.first_io_limit+tolerance
+            r = r._replace(violation=violation)
+            if violation:
+                logging.warning(r)
+            else:
+                logging.info(r)
+            ret.append(r)
+
+    nvme0.setfeatures(0x2, cdw11=orig_ps).waitdone()
+    return ret
+
+
+def apst_table(psd, idle_ms, target=None):
+    """Autonomous Power State Transition data structure of feature 0x0C
+
+    Every power state shallower than target transitions to target after
+    idle_ms milliseconds in idle. target is the deepest non-operational
+    state in psd by default.
+
+    return: 256 bytes of 32 entries, ITPS in bits 7:3 and ITPT in 31:8
+    """
+
+    if target is None:
+        target = max(i for i, ps in enumerate(psd) if ps.flags&0x2)
+    table = np.zeros(32, dtype="<u8")
+    table[:target] = (idle_ms<<8)|(target<<3)
+    return table.tobytes()
+
+
+ApstResult = collections.namedtuple("ApstResult", [
+    "idle_ms", "idle", "entered", "wake", "wake_penalty", "iops"])
+
+
+def apst_sweep(nvme0, nvme0n1, qpair, psd, thresholds, idle_ratio=2,
+               burst=32, rounds=20, lba=0):
+    """wake latency and throughput of idle and burst IO for APST settings
+
+    For each idle threshold in milliseconds, APST is enabled with the
+    table of apst_table(), and every round is an idle of idle_ratio times
+    the threshold, followed by a read timed as the wake latency, and a
+    burst of reads timed for IOPS. The power state is read by Get
+    Features before the read, an admin command which does not wake the
+    controller. APST disabled is measured first as the baseline, as
+    idle_ms None, with the idle of the shortest threshold. The sweep
+    starts in PS0, and the original APST setting and power state are
+    restored at the end.
+
+    return: list of ApstResult, percentiles and idle in seconds, entered
+            is the ratio of rounds in the target state after the idle,
+            and the wake penalty is the median over the baseline
+    """
+
+    buf = Buffer(4096)
+    orig = Buffer(4096)
+    apste = nvme0.getfeatures(0xc, buf=orig).waitdone()&0x1
+    orig_ps = nvme0.getfeatures(0x2).waitdone()
+    nvme0.setfeatures(0x2, cdw11=0).waitdone()
+    target = max(i for i, ps in enumerate(psd) if ps.flags&0x2)
+
+    ret = []
+    baseline = None
+    for idle_ms in (None,)+tuple(thresholds):
+        if idle_ms is None:
+            idle = idle_ratio*min(thresholds)/1000
+            buf[0:256] = bytes(256)
+            nvme0.setfeatures(0xc, cdw11=0, buf=buf).waitdone()
+        else:
+            idle = idle_ratio*idle_ms/1000
+            buf[0:256] = apst_table(psd, idle_ms, target)
+            nvme0.setfeatures(0xc, cdw11=1, buf=buf).waitdone()
+
+        entered = 0
+        wake = []
+        burst_time = 0.0
+        for i in range(rounds):
+            time.sleep(idle)
+            entered += nvme0.getfeatures(0x2).waitdone()&0x1f == target
+            wake.append(timed(nvme0n1.read, qpair, buf, lba))
+            start = time.perf_counter()
+            for j in range(burst):
+                nvme0n1.read(qpair, buf, lba+j)
+            qpair.waitdone(burst)
+            burst_time += time.perf_counter()-start
+
+        wake = percentiles(wake)
+        if baseline is None:
+            baseline = wake[50]
+        r = ApstResult(idle_ms, idle, entered/rounds, wake, wake[50]-baseline,
+                       burst*rounds/burst_time)
+        logging.info(r)
+        ret.append(r)
+
+    nvme0.setfeatures(0xc, cdw11=apste, buf=orig).waitdone()
+    nvme0.setfeatures(0x2, cdw11=orig_ps).waitdone()
+    return ret
+
+
+RaceSearch = collections.namedtuple("RaceSearch", ["windows", "samples"])
+
+
+def race_search(probe, low, high, budget=200, coarse=32, resolution=1):
+    """locate the windows of delay where probe(delay) finds an anomaly
+
+    A coarse sweep of evenly spaced delays comes first. Then, until the
+    budget of probes is spent, the widest interval between two delays of
+    different results is bisected, so the edges of every window of every
+    class are refined to resolution. When all edges are refined, the
+    widest untested gap is probed to find narrow windows missed by the
+    sweep.
+
+    probe: function of an int delay, returns the class of the anomaly,
+           e.g. "data" or "latency", or None when nothing is found. True
+           is the class "anomaly".
+    return: RaceSearch, windows are the inclusive (first, last) delays of
+            each anomaly, in a dict keyed by the class, and samples are
+            the probed delays and their results
+    """
+
+    assert low <= high and coarse >= 2
+    samples = {}
+
+    def run(delay):
+        ret = probe(delay)
+        samples[delay] = "anomaly" if ret is True else (ret or None)
+        logging.debug("delay %d: %s" % (delay, samples[delay]))
+
+    step = (high-low)/(coarse-1)
+    for i in range(coarse):
+        if len(samples) == budget:
+            break
+        delay = low+int(round(i*step))
+        if delay not in samples:
+            run(delay)
+
+    while len(samples) < budget:
+        delays = sorted(samples)
+        gaps = [(b-a, a, b) for a, b in zip(delays, delays[1:])
+                if b-a > resolution]
+        if not gaps:
+            break
+        edges = [g for g in gaps if samples[g[1]] != samples[g[2]]]
+        width, a, b = max(edges or gaps)
+        run((a+b)//2)
+
+    windows = {}
+    last = None
+    for delay in sorted(samples):
+        cls = samples[delay]
+        if cls is not None and cls == last:
+            windows[cls][-1] = (windows[cls][-1][0], delay)
+        elif cls is not None:
+            windows.setdefault(cls, []).append((delay, delay))
+        last = cls
+    return RaceSearch(windows, samples)
+
+
+def bandwidth(nvme0n1, io_size=128, qdepth=16, read_percentage=100,
+              lba_random=False, seconds=1, lba_size=512,
+              monitor=None, interval=0.01):
+    """MB/s of an ioworker with the workload
+
+    monitor: function called every interval seconds while the IO runs
+    """
+
+    w = nvme0n1.ioworker(io_size=io_size,
+                         lba_align=io_size,
+                         lba_random=lba_random,
+                         qdepth=qdepth,
+                         read_percentage=read_percentage,
+                         time=seconds).start()
+    while monitor and w.running:
+        monitor()
+        time.sleep(interval)
+    r = w.close()
+    logging.debug(r)
+    io_count = r.io_count_read+r.io_count_nonread
+    return io_count*io_size*lba_size/(r.mseconds*1000)
+
+
+class Baseline(object):
+    """results of benchmarks persisted in a JSON file
+
+    Results are keyed by the test conditions. The first result of a key
+    becomes its baseline, and later results regress when they are lower
+    than the baseline by more than tolerance, a ratio. With update, every
+    result replaces the baseline.
+    """
+
+    def __init__(self, path, tolerance=0.1, update=False):
+        self.path = path
+        self.tolerance = tolerance
+        self.update = update
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+
+    @staticmethod
+    def key(**conditions):
+        return ",".join("%s=%s" % c for c in sorted(conditions.items()))
+
+    def check(self, key, value):
+        """record the result, return False if it regresses"""
+
+        base = self.data.get(key)
+        logging.info("%s: %g, baseline %s" % (key, value, base))
+        if base is None or self.update:
+            self.data[key] = value
+            return True
+        return value >= base*(1-self.tolerance)
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+
+
+ReadyLatency = collections.namedtuple("ReadyLatency", [
+    "disable", "enable", "timeout"])
+
+
+def _wait_ready(nvme0, ready, start, timeout):
+    while (nvme0[0x1c]&0x1) != ready:
+        if time.perf_counter()-start > timeout:
+            raise TimeoutError("CSTS.RDY is not %d in %gs" % (ready, timeout))
+    return time.perf_counter()-start
+
+
+def ready_latency(nvme0, cycles=100):
+    """latency of CSTS.RDY following CC.EN in disable and enable cycles
+
+    CC is written with its current value, and CSTS is polled from the
+    write. The admin queue is not initialized again, so reset the
+    controller after the cycles.
+
+    return: ReadyLatency, percentiles with the maximum (100) of disable
+            to not ready and enable to ready, and CAP.TO, all in seconds
+    """
+
+    timeout = ((nvme0.cap>>24)&0xff)*0.5
+    cc = nvme0[0x14]|0x1
+    disable = []
+    enable = []
+    for i in range(cycles):
+        start = time.perf_counter()
+        nvme0[0x14] = cc&~0x1
+        disable.append(_wait_ready(nvme0, 0, start, timeout))
+
+        start = time.perf_counter()
+        nvme0[0x14] = cc
+        enable.append(_wait_ready(nvme0, 1, start, timeout))
+
+    pcts = PERCENTILES+(100,)
+    ret = ReadyLatency(percentiles(disable, pcts),
+                       percentiles(enable, pcts), timeout)
+    logging.info(ret)
+    return ret
+
+
+LinkSpeed = collections.namedtuple("LinkSpeed", [
+    "target", "reset_time", "link_up_time", "ready_time",
+    "speed", "width", "loaded_speed", "loaded_width", "mbps"])
+
+
+def _link_up(linksts):
+    # readable, trained, and at a speed
+    return linksts != 0xffff and not linksts&0x800 and linksts&0xf
+
+
+def retrain(pcie, nvme0, target, timeout=1):
+    """retrain the link at the target speed
+
+    Target Link Speed of Link Control 2 is written before a reset of the
+    function. The time of the reset, of Link Status reporting a trained
+    link after it, and of the controller reset are measured. timeout
+    starts after the reset.
+
+    return: reset time, link up time and ready time, in seconds
+    """
+
+    pciecap = capabilities(pcie).offset(0x10)
+    linkctl2 = pcie.register(pciecap+0x30, 2)
+    pcie[pciecap+0x30] = (linkctl2&0xf0)|target
+
+    start = time.perf_counter()
+    pcie.reset()
+    reset_time = time.perf_counter()-start
+    deadline = time.perf_counter()+timeout
+    while not _link_up(pcie.register(pciecap+0x12, 2)):
+        if time.perf_counter() > deadline:
+            raise TimeoutError("link is not up in %gs" % timeout)
+    link_up_time = time.perf_counter()-start
+    nvme0.reset()
+    return reset_time, link_up_time, time.perf_counter()-start
+
+
+def link_speed(pcie, nvme0, nvme0n1, target, seconds=1, lba_size=512,
+               timeout=1):
+    """retrain the link at the target speed, and read with the link
+
+    The link is retrained by retrain(). The negotiated speed and width
+    are read from Link Status before the IO, and the lowest of them while
+    128KB sequential reads run.
+
+    return: LinkSpeed, times in seconds
+    """
+
+    pciecap = capabilities(pcie).offset(0x10)
+    reset_time, link_up_time, ready_time = retrain(pcie, nvme0, target, timeout)
+
+    linksts = pcie.register(pciecap+0x12, 2)
+    loaded = [linksts]
+    mbps = bandwidth(nvme0n1, 128*1024//lba_size, 16,
+                     seconds=seconds, lba_size=lba_size,
+                     monitor=lambda: loaded.append(pcie.register(pciecap+0x12, 2)))
+    ret = LinkSpeed(target, reset_time, link_up_time, ready_time,
+                    linksts&0xf, (linksts>>4)&0x3f,
+                    min(s&0xf for s in loaded),
+                    min((s>>4)&0x3f for s in loaded),
+                    mbps)
+    logging.info(ret)
+    return ret
+
+
+AspmLatency = collections.namedtuple("AspmLatency", [
+    "aspm", "gap", "first_io", "penalty", "limit", "violation"])
+
+
+def l1_exit_latency(linkcap):
+    """upper bound of L1 exit latency in Link Capabilities, in seconds
+
+    None for more than 64us, which has no upper bound.
+    """
+
+    code = (linkcap>>15)&0x7
+    return None if code == 7 else (1<<code)/1000000
+
+
+def aspm_latency(pcie, nvme0n1, qpair, settings=(0, 2), gaps=(0.001, 0.01, 0.1),
+                 repeat=50, lba=0, tolerance=0.00005):
+    """first IO latency after an idle gap, for ASPM settings and gaps
+
+    Each sample is an idle of gap seconds followed by one read. The
+    penalty is the 99th percentile over the one with ASPM disabled at the
+    same gap, and with L1 enabled it is compared with the L1 exit latency
+    in Link Capabilities, plus tolerance seconds of jitter. The original
+    ASPM setting is restored at the end.
+
+    settings: ASPM Control values, 0 disabled, 1 L0s, 2 L1, 3 L0s and L1
+    return: list of AspmLatency, percentiles and limits in seconds
+    """
+
+    buf = Buffer(4096)
+    linkcap = pcie.register(capabilities(pcie).offset(0x10)+12, 4)
+    limit = l1_exit_latency(linkcap)
+    orig_aspm = pcie.aspm
+
+    ret = []
+    baseline = {}
+    for aspm in (0,)+tuple(a for a in settings if a != 0):
+        pcie.aspm = aspm
+        for gap in gaps:
+            samples = []
+            for i in range(repeat):
+                time.sleep(gap)
+                samples.append(timed(nvme0n1.read, qpair, buf, lba))
+            first_io = percentiles(samples)
+            baseline.setdefault(gap, first_io[99])
+            penalty = first_io[99]-baseline[gap]
+            r = AspmLatency(aspm, gap, first_io, penalty,
+                            limit if aspm&0x2 else None, False)
+            if r.limit is not None and penalty > r.limit+tolerance:
+                r = r._replace(violation=True)
+            if r.violation:
+                logging.warning(r)
+            else:
+                logging.info(r)
+            if aspm in settings:
+                ret.append(r)
+
+    pcie.aspm = orig_aspm
+    return ret
+
+
+D3Resume = collections.namedtuple("D3Resume", [
+    "latency", "retries", "mismatches"])
+
+
+def d3hot_resume(pcie, nvme0n1, qpair, cycles=100, d3_time=0.01,
+                 lba=0, lba_size=512, timeout=1):
+    """latency from the D0 request to the first successful IO after D3hot
+
+    The cycles LBAs from lba are written with the lba pattern first. Each
+    cycle puts the function in D3hot for d3_time seconds, requests D0, and
+    reads its own LBA until the read completes without error, which is
+    timed. The data of every read is verified with the lba pattern.
+
+    return: D3Resume, percentiles of the latency in seconds, the number of
+            failed reads before success, and the mismatched LBAs
+    """
+
+    buf = Buffer(lba_size)
+    for i in range(cycles):
+        fill(buf, "lba", lba=lba+i, lba_size=lba_size)
+        nvme0n1.write(qpair, buf, lba+i).waitdone()
+
+    status = 0
+    def read_cb(cdw0, status1):
+        nonlocal status
+        status = (status1>>1)&0x7ff
+
+    latency = []
+    retries = 0
+    mismatches = []
+    for i in range(cycles):
+        pcie.power_state = 3
+        time.sleep(d3_time)
+
+        start = time.perf_counter()
+        pcie.power_state = 0
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            while True:
+                nvme0n1.read(qpair, buf, lba+i, cb=read_cb).waitdone()
+                if status == 0:
+                    break
+                retries += 1
+                if time.perf_counter()-start > timeout:
+                    raise TimeoutError("no IO completes in %gs after D0" % timeout)
+        latency.append(time.perf_counter()-start)
+
+        first, count = verify_pattern(buf, "lba", lba=lba+i, lba_size=lba_size)
+        if count:
+            mismatches.append(lba+i)
+
+    ret = D3Resume(percentiles(latency), retries, mismatches)
+    logging.info(ret)
+    return ret
+
+
+QosResult = collections.namedtuple("QosResult", [
+    "weights", "rounds", "iops", "share", "share_ci", "latency",
+    "urgent_latency"])
+
+
+def wrr_qos(nvme0, nvme0n1, weights, burst=3, round_time=2, min_rounds=3,
+            max_rounds=15, precision=0.02, urgent_iops=1000, qdepth=64,
+            io_size=8, region_end=0x10000):
+    """QoS of high, medium and low priority reads in weighted round robin
+
+    The weights are set in feature 0x01, then rounds of round_time
+    seconds run a saturating ioworker of each priority, and an urgent
+    ioworker of urgent_iops at qdepth 1. The rounds stop early when the
+    95% confidence interval of the IOPS share of every priority is within
+    precision, a ratio, after min_rounds.
+
+    weights: weights of (high, medium, low), 1 to 256
+    return: QosResult, IOPS, share and its confidence interval by qprio,
+            and the latency percentiles in us averaged over the rounds
+    """
+
+    cdw11 = ((weights[0]-1)<<24)|((weights[1]-1)<<16)|((weights[2]-1)<<8)|burst
+    nvme0.setfeatures(1, cdw11=cdw11).waitdone()
+
+    prios = (1, 2, 3)
+    io_count = {p: [] for p in prios}
+    latency = {p: [] for p in (0,)+prios}
+    seconds = 0
+    for rounds in range(1, max_rounds+1):
+        workers = {}
+        for p in (0,)+prios:
+            pct = dict.fromkeys(PERCENTILES)
+            w = nvme0n1.ioworker(io_size=io_size,
+                                 read_percentage=100,
+                                 region_end=region_end,
+                                 qprio=p,
+                                 qdepth=1 if p == 0 else qdepth,
+                                 iops=urgent_iops if p == 0 else 0,
+                                 time=round_time,
+                                 output_percentile_latency=pct)
+            workers[p] = (w, pct)
+        for w, pct in workers.values():
+            w.start()
+        for p, (w, pct) in workers.items():
+            r = w.close()
+            if p:
+                io_count[p].append(r.io_count_read)
+            latency[p].append([pct[k] for k in PERCENTILES])
+        seconds += round_time
+
+        counts = np.array([io_count[p] for p in prios], dtype=float)
+        shares = counts/counts.sum(axis=0)
+        ci = 1.96*shares.std(axis=1, ddof=1)/np.sqrt(rounds) \
+            if rounds > 1 else np.ones(len(prios))
+        logging.debug("round %d, share %s, ci %s" % (rounds, shares[:, -1], ci))
+        if rounds >= min_rounds and ci.max() < precision:
+            break
+
+    def average(p):
+        return dict(zip(PERCENTILES, np.mean(latency[p], axis=0).tolist()))
+
+    ret = QosResult(tuple(weights), rounds,
+                    {p: sum(io_count[p])/seconds for p in prios},
+                    dict(zip(prios, shares.mean(axis=1).tolist())),
+                    dict(zip(prios, ci.tolist())),
+                    {p: average(p) for p in prios},
+                    average(0))
+    logging.info(ret)
+    return ret
+
+
+CoalescingResult = collections.namedtuple("CoalescingResult", [
+    "aggregation_time", "threshold", "disabled",
+    "interrupts_per_io", "iops", "latency"])
+
+
+def _wait_msix(qpair, start, timeout):
+    while not qpair.msix_isset():
+        if time.perf_counter()-start > timeout:
+            raise TimeoutError("no interrupt in %gs" % timeout)
+    return time.perf_counter()-start
+
+
+def coalescing_sweep(nvme0, nvme0n1, qpair, times, thresholds,
+                     disable=(False, True), batch=8, rounds=200, lba=0,
+                     timeout=1):
+    """interrupts, IOPS and interrupt latency of coalescing settings
+
+    For every aggregation time (in 100us) and threshold (0's based) of
+    feature 0x08, and coalescing disabled or not for the vector of the
+    qpair in feature 0x09, each round clears the MSI-X of the qpair,
+    submits batch reads, and times the first interrupt. Then the reads
+    are reaped one by one, and another interrupt is counted whenever it
+    is pending after a read is reaped. The pending flag is sampled, so
+    the interrupts per IO are a lower bound. The original features are
+    restored.
+
+    return: list of CoalescingResult, latency percentiles from the
+            submission to the first interrupt in seconds
+    """
+
+    buf = Buffer(4096)
+    iv = qpair.sqid
+    orig_coalescing = nvme0.getfeatures(8).waitdone()
+    orig_vector = nvme0.getfeatures(9, cdw11=iv).waitdone()
+
+    ret = []
+    for cd in disable:
+        nvme0.setfeatures(9, cdw11=iv|(cd<<16)).waitdone()
+        for aggregation_time in times:
+            for threshold in thresholds:
+                nvme0.setfeatures(8, cdw11=(aggregation_time<<8)|threshold).waitdone()
+                interrupts = 0
+                latency = []
+                with Timer() as t:
+                    for i in range(rounds):
+                        qpair.msix_clear()
+                        start = time.perf_counter()
+                        for j in range(batch):
+                            nvme0n1.read(qpair, buf, lba+j)
+                        latency.append(_wait_msix(qpair, start, timeout))
+                        interrupts += 1
+                        for j in range(batch):
+                            qpair.msix_clear()
+                            qpair.waitdone()
+                            interrupts += qpair.msix_isset()
+                        qpair.msix_clear()
+
+                r = CoalescingResult(aggregation_time, threshold, cd,
+                                     interrupts/(batch*rounds),
+                                     batch*rounds/t.wall,
+                                     percentiles(latency))
+                logging.info(r)
+                ret.append(r)
+
+    nvme0.setfeatures(8, cdw11=orig_coalescing&0xffff).waitdone()
+    nvme0.setfeatures(9, cdw11=iv|(orig_vector&0x10000)).waitdone()
+    return ret
+
+
+CompletionMode = collections.namedtuple("CompletionMode", [
+    "qcount", "mode", "iops", "latency", "cpu_per_io", "io_count", "errors"])
+
+# how completions are waited: polling the CQ, or for MSI-X of the qpairs
+COMPLETION_MODES = ("poll", "irq")
+
+
+def completion_mode(nvme0, nvme0n1, qcount, mode="poll", batch=8,
+                    seconds=1, qdepth=16, strategy="backoff"):
+    """IOPS, latency and host CPU time of polled or interrupt completions
+
+    Every round submits batch reads to each of qcount qpairs, and waits
+    all of them. poll reaps each qpair in turn by spinning on its CQ.
+    irq waits with the strategy of raw_queue.pause() until the MSI-X of
+    a qpair is pending, and only then reaps that qpair, so the host is
+    free while waiting. The CPU time is of the process in this mode only.
+
+    return: CompletionMode, latency percentiles of rounds in seconds
+    """
+
+    assert mode in COMPLETION_MODES
+    assert batch < qdepth
+    buf = Buffer(4096)
+    qpairs = [Qpair(nvme0, qdepth) for i in range(qcount)]
+
+    errors = 0
+    def count_error(cdw0, status1):
+        nonlocal errors
+        errors += (status1>>1) != 0
+
+    io_count = 0
+    latency = []
+    with Timer() as t:
+        deadline = time.perf_counter()+seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            for i, q in enumerate(qpairs):
+                q.msix_clear()
+                for j in range(batch):
+                    nvme0n1.read(q, buf, i*batch+j, cb=count_error)
+            if mode == "poll":
+                for q in qpairs:
+                    q.waitdone(batch)
+            else:
+                pending = list(qpairs)
+                delay = BACKOFF_MIN
+                while pending:
+                    ready = [q for q in pending if q.msix_isset()]
+                    for q in ready:
+                        q.waitdone(batch)
+                        pending.remove(q)
+                    if not ready:
+                        delay = pause(strategy, delay)
+                    else:
+                        delay = BACKOFF_MIN
+            latency.append(time.perf_counter()-start)
+            io_count += batch*qcount
+
+    for q in qpairs:
+        q.delete()
+
+    ret = CompletionMode(qcount, mode, io_count/t.wall, percentiles(latency),
+                         t.cpu/max(io_count, 1), io_count, errors)
+    logging.info(ret)
+    return ret
+
+
+DoorbellResult = collections.namedtuple("DoorbellResult", [
+    "doorbell", "iops", "latency", "sq_writes", "cq_writes", "mmio_writes",
+    "errors"])
+
+
+def doorbell_policy(nvme0, doorbell, qdepth=64, io_size=8, seconds=1,
+                    nsid=1, dbbuf=None):
+    """IOPS and command latency of one raw queue with the doorbell policy
+
+    Like a driver, the tail is updated after every submitted entry, and
+    the head after every reaped entry. The Doorbell policy of both queues
+    decides which updates are written. A reaped entry is replaced by a
+    read to the same slot, so qdepth-1 commands are outstanding. When no
+    entry is posted, or with the flush policy after every pass, deferred
+    updates are flushed, so the queues do not stall.
+
+    return: DoorbellResult, latency percentiles of commands in seconds,
+            writes are doorbell writes per IO
+    """
+
+    assert io_size <= 8
+    cq = IOCQ(nvme0, 1, qdepth, PRP(qdepth*16), dbbuf=dbbuf,
+              doorbell=doorbell)
+    sq = IOSQ(nvme0, 1, qdepth, PRP(qdepth*64), cqid=1, dbbuf=dbbuf,
+              doorbell=doorbell)
+    cmds = SQEBatch(qdepth, 2, nsid).cid(0).nlb(io_size-1)
+    cmds.slba(0, io_size).prp1([PRP()])
+    sq.put(cmds)
+
+    # the cid of the command in each slot is the slot
+    start = [0.0]*qdepth
+    latency = []
+    errors = 0
+    tail = 0
+    with Timer() as t:
+        deadline = time.perf_counter()+seconds
+        for i in range(qdepth-1):
+            start[tail] = time.perf_counter()
+            tail += 1
+            sq.tail = tail
+        sq.flush()
+
+        while time.perf_counter() < deadline:
+            cqe_list = cq.poll()
+            now = time.perf_counter()
+            errors += int(np.count_nonzero(cqe_list.sc|cqe_list.sct))
+            for cqe in cqe_list:
+                latency.append(now-start[cqe.cid])
+                cq.head = (cq.head+1)%qdepth
+                start[tail] = time.perf_counter()
+                tail = (tail+1)%qdepth
+                sq.tail = tail
+            if not len(cqe_list) or doorbell.policy == "flush":
+                sq.flush()
+                cq.flush()
+
+    # drain outstanding commands before deleting the queues, and write
+    # the head after every reap, so the CQ does not fill up
+    sq.flush()
+    for i in range(qdepth-1):
+        cqe_list = cq.waitdone(1, update_head=True)
+        errors += int(np.count_nonzero(cqe_list.sc|cqe_list.sct))
+        cq.flush()
+    io_count = len(latency)
+    sq.delete()
+    cq.delete()
+
+    ret = DoorbellResult(doorbell, io_count/t.wall, percentiles(latency),
+                         sq.doorbell_writes/max(io_count, 1),
+                         cq.doorbell_writes/max(io_count, 1),
+                         (sq.mmio_writes+cq.mmio_writes)/max(io_count, 1),
+                         errors)
+    logging.info(ret)
+    return ret
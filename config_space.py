@@ -0,0 +1,177 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import logging
+import collections
+
+
+# capability ids, extended capabilities are flagged by EXT
+EXT = 0x10000
+PM = 0x01
+MSI = 0x05
+PCIE = 0x10
+MSIX = 0x11
+AER = EXT|0x01
+L1SS = EXT|0x1e
+
+CONFIG_SIZE = 4096
+
+
+Field = collections.namedtuple("Field", ["cap", "offset", "size", "lsb", "bits"])
+
+# decoded fields: capability (None for the header), byte offset in the
+# capability, byte size of the register, and the bit field in it
+FIELDS = collections.OrderedDict([
+    ("vendor_id", Field(None, 0x00, 2, 0, 16)),
+    ("device_id", Field(None, 0x02, 2, 0, 16)),
+    ("command", Field(None, 0x04, 2, 0, 16)),
+    ("status", Field(None, 0x06, 2, 0, 16)),
+    ("revision_id", Field(None, 0x08, 1, 0, 8)),
+    ("class_code", Field(None, 0x09, 3, 0, 24)),
+    ("bist", Field(None, 0x0f, 1, 0, 8)),
+    ("bar0", Field(None, 0x10, 4, 0, 32)),
+    ("bar1", Field(None, 0x14, 4, 0, 32)),
+    ("subsystem", Field(None, 0x2c, 4, 0, 32)),
+    ("interrupt_line", Field(None, 0x3c, 1, 0, 8)),
+    ("pmcsr", Field(PM, 0x04, 2, 0, 16)),
+    ("power_state", Field(PM, 0x04, 2, 0, 2)),
+    ("msi_control", Field(MSI, 0x02, 2, 0, 16)),
+    ("msix_enable", Field(MSIX, 0x02, 2, 15, 1)),
+    ("msix_table_size", Field(MSIX, 0x02, 2, 0, 11)),
+    ("devcap", Field(PCIE, 0x04, 4, 0, 32)),
+    ("devctl", Field(PCIE, 0x08, 2, 0, 16)),
+    ("max_payload_size", Field(PCIE, 0x08, 2, 5, 3)),
+    ("max_read_request_size", Field(PCIE, 0x08, 2, 12, 3)),
+    ("devsts", Field(PCIE, 0x0a, 2, 0, 16)),
+    ("max_link_speed", Field(PCIE, 0x0c, 4, 0, 4)),
+    ("max_link_width", Field(PCIE, 0x0c, 4, 4, 6)),
+    ("aspm_support", Field(PCIE, 0x0c, 4, 10, 2)),
+    ("linkctl", Field(PCIE, 0x10, 2, 0, 16)),
+    ("aspm", Field(PCIE, 0x10, 2, 0, 2)),
+    ("link_speed", Field(PCIE, 0x12, 2, 0, 4)),
+    ("link_width", Field(PCIE, 0x12, 2, 4, 6)),
+    ("link_training", Field(PCIE, 0x12, 2, 11, 1)),
+    ("link_active", Field(PCIE, 0x12, 2, 13, 1)),
+    ("devctl2", Field(PCIE, 0x28, 2, 0, 16)),
+    ("target_link_speed", Field(PCIE, 0x30, 2, 0, 4)),
+    ("aer_uncorrectable", Field(AER, 0x04, 4, 0, 32)),
+    ("aer_correctable", Field(AER, 0x10, 4, 0, 32)),
+    ("l1ss_control", Field(L1SS, 0x08, 4, 0, 32)),
+])
+
+
+class Capabilities(object):
+    """offsets of the standard and extended capabilities of a function
+
+    read: function of a dword offset in the config space, returns the dword
+    """
+
+    def __init__(self, read):
+        self._offsets = {}
+
+        # standard capability list, from the pointer at 0x34
+        ptr = read(0x34)&0xfc
+        for i in range(48):
+            if ptr == 0:
+                break
+            header = read(ptr)
+            self._offsets.setdefault(header&0xff, ptr)
+            ptr = (header>>8)&0xfc
+
+        # extended capability list, from 0x100
+        ptr = 0x100
+        for i in range(960):
+            header = read(ptr)
+            if header in (0, 0xffffffff):
+                break
+            self._offsets.setdefault(EXT|(header&0xffff), ptr)
+            ptr = (header>>20)&0xffc
+            if ptr == 0:
+                break
+
+    def offset(self, cap_id):
+        """offset of the capability, None if the function does not have it"""
+        return self._offsets.get(cap_id)
+
+    def __contains__(self, cap_id):
+        return cap_id in self._offsets
+
+    def __repr__(self):
+        return "Capabilities(%s)" % ", ".join(
+            "0x%x@0x%x" % c for c in sorted(self._offsets.items()))
+
+
+# the last Pcie object and its capability index
+_capabilities = [None, None]
+
+
+def capabilities(pcie):
+    """capability index of the function, walked once per Pcie object
+
+    The index of the last Pcie object is kept, so later calls on the
+    same object do not walk the capability lists again. Another Pcie
+    object, e.g. of another function, gets its own index.
+    """
+
+    if _capabilities[0] is not pcie:
+        _capabilities[:] = [pcie, Capabilities(lambda o: pcie.register(o, 4))]
+        logging.debug(_capabilities[1])
+    return _capabilities[1]
+
+
+class ConfigSpace(object):
+    """one-shot snapshot of the configuration space of a function
+
+    The config space is read once in dwords, and registers, capabilities
+    and the decoded FIELDS are all served from the snapshot.
+    """
+
+    def __init__(self, pcie, size=CONFIG_SIZE):
+        self.data = b"".join(pcie.register(o, 4).to_bytes(4, "little")
+                             for o in range(0, size, 4))
+        self.caps = Capabilities(self.register)
+
+    def register(self, offset, size=4):
+        return int.from_bytes(self.data[offset:offset+size], "little")
+
+    def __getitem__(self, name):
+        """decoded field, None if its capability is not present"""
+
+        field = FIELDS[name]
+        base = 0
+        if field.cap is not None:
+            base = self.caps.offset(field.cap)
+            if base is None:
+                return None
+        value = self.register(base+field.offset, field.size)
+        return (value>>field.lsb)&((1<<field.bits)-1)
+
+    def fields(self):
+        return collections.OrderedDict((n, self[n]) for n in FIELDS)
+
+    def changed(self, other):
+        """offsets of the dwords different in the other snapshot"""
+        return [o for o in range(0, min(len(self.data), len(other.data)), 4)
+                if self.data[o:o+4] != other.data[o:o+4]]
+
+    def diff(self, other):
+        """decoded fields changed in the other snapshot: (self, other)"""
+        return collections.OrderedDict(
+            (n, (self[n], other[n])) for n in FIELDS if self[n] != other[n])
@@ -0,0 +1,74 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import os
+import sys
+import pytest
+import logging
+
+
+# helper modules (e.g. raw_queue) live at the root of the conformance test
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dma import BufferPool, PRPChainCache
+from identify import IdentifyCache
+from bench import Baseline
+
+
+def pytest_addoption(parser):
+    parser.addoption("--baseline", default="baseline.json",
+                     help="JSON file of benchmark baselines")
+    parser.addoption("--tolerance", type=float, default=0.1,
+                     help="ratio of regression from the baselines")
+    parser.addoption("--update-baseline", action="store_true",
+                     help="replace the baselines with the results")
+    parser.addoption("--pcie-matrix", action="store_true",
+                     help="run the full matrix of PCIe bandwidth")
+
+
+@pytest.fixture(scope="session")
+def buffer_pool():
+    ret = BufferPool()
+    yield ret
+    logging.info("buffer pool: %s" % ret.stats())
+
+
+@pytest.fixture(scope="module")
+def prp_chains():
+    ret = PRPChainCache()
+    yield ret
+    logging.info("prp chains: %s" % ret.stats())
+    ret.clear()
+
+
+@pytest.fixture(scope="session")
+def id_cache():
+    ret = IdentifyCache()
+    yield ret
+    logging.info("identify cache: %s" % ret.stats())
+
+
+@pytest.fixture(scope="session")
+def baseline(pytestconfig):
+    ret = Baseline(pytestconfig.getoption("baseline"),
+                   pytestconfig.getoption("tolerance"),
+                   pytestconfig.getoption("update_baseline"))
+    yield ret
+    ret.save()
@@ -0,0 +1,318 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import contextlib
+import collections
+import numpy as np
+
+from nvme import Buffer
+
+
+def as_array(buf, dtype=np.uint8, start=0, end=None):
+    """numpy array of the data of a Buffer or PRP, between start and end
+
+    Buffer does not export the buffer protocol, so the data is copied
+    once into the array. Changes of the array are not written back.
+    """
+
+    if end is None:
+        end = buf.size
+    return np.frombuffer(buf[start:end], dtype=dtype)
+
+
+def parse(buf, dtype, start=0, count=None):
+    """data structures in the buffer, as a structured array of dtype
+
+    count: number of structures, None to return the first one as a record
+    """
+
+    n = 1 if count is None else count
+    ret = as_array(buf, dtype, start, start+n*dtype.itemsize)
+    return ret[0] if count is None else ret
+
+
+# data patterns of fill() and verify_pattern()
+PATTERNS = ("const", "pattern32", "lba", "random")
+
+
+def expected_data(size, pattern="const", value=0, lba=0, lba_size=512):
+    """data of the pattern, in a numpy array of bytes
+
+    const: every byte is value
+    pattern32: value in little endian 32-bit words
+    lba: every 64-bit word of a block is its lba, counted from lba
+    random: bytes from a PRNG seeded with value
+    """
+
+    assert pattern in PATTERNS
+    if pattern == "const":
+        return np.full(size, value, dtype=np.uint8)
+    if pattern == "pattern32":
+        words = np.full((size+3)//4, value, dtype="<u4")
+        return words.view(np.uint8)[:size]
+    if pattern == "lba":
+        blocks = (size+lba_size-1)//lba_size
+        words = np.repeat(np.arange(lba, lba+blocks, dtype="<u8"), lba_size//8)
+        return words.view(np.uint8)[:size]
+    return np.random.default_rng(value).integers(0, 256, size, dtype=np.uint8)
+
+
+def fill(buf, pattern="const", value=0, lba=0, lba_size=512, start=0, end=None):
+    """fill the data of the buffer between start and end in one copy"""
+
+    if end is None:
+        end = buf.size
+    data = expected_data(end-start, pattern, value, lba, lba_size)
+    buf[start:end] = data.tobytes()
+
+
+def verify_pattern(buf, pattern="const", value=0, lba=0, lba_size=512, start=0, end=None):
+    """compare the data of the buffer between start and end with the pattern
+
+    return: the offset of the first mismatched byte, None if all match,
+    and the number of mismatched bytes
+    """
+
+    if end is None:
+        end = buf.size
+    data = np.frombuffer(buf[start:end], dtype=np.uint8)
+    mismatch = np.flatnonzero(data != expected_data(end-start, pattern, value,
+                                                    lba, lba_size))
+    if len(mismatch) == 0:
+        return None, 0
+    return start+int(mismatch[0]), len(mismatch)
+
+
+def page_size(nvme0):
+    """memory page size configured in CC.MPS"""
+    return 4096<<((nvme0[0x14]>>7)&0xf)
+
+
+class PRPChain(object):
+    """PRP entries of one transfer, with its data and PRP lists allocated once
+
+    The data region is one buffer of all the pages. All PRP list pages
+    are in another buffer, filled in one copy. When the entries do not
+    fit in one list page, its last entry points to the next list page.
+
+    offset: offset of data in the first page, which is the offset of PRP1
+    list_offset: offset of the first PRP list, which is the offset of PRP2
+    list_entries: entries of each PRP list page, default to the page end
+    """
+
+    def __init__(self, nvme0, length, offset=0, list_offset=0,
+                 list_entries=None, ptype=0, pvalue=0):
+        page = page_size(nvme0)
+        pages = (offset+length+page-1)//page
+        if list_entries is None:
+            capacity = [(page-list_offset)//8, page//8]
+        else:
+            capacity = [list_entries, list_entries]
+        assert 0 <= offset < page
+        assert list_offset%8 == 0 and list_offset+capacity[0]*8 <= page
+
+        self.length = length
+        self.page_size = page
+        self.data = Buffer(pages*page, "PRP chain data", pvalue=pvalue, ptype=ptype)
+        self.lists = None
+        self.prp1 = self.data.phys_addr+offset
+        self.prp2 = 0
+
+        # data pages pointed by PRP2 or PRP lists
+        addr = self.data.phys_addr+page*np.arange(1, pages, dtype=np.uint64)
+        self._where = np.zeros(len(addr), dtype=np.int64)
+        entries = None
+        if len(addr) == 1:
+            self.prp2 = int(addr[0])
+        elif len(addr) > 1:
+            # entries of each list page, except the chain pointer
+            layout = []
+            remain = len(addr)
+            while remain > capacity[len(layout) > 0]:
+                layout.append(capacity[len(layout) > 0]-1)
+                remain -= layout[-1]
+            layout.append(remain)
+
+            self.lists = Buffer(len(layout)*page, "PRP lists")
+            entries = np.zeros(len(layout)*page//8, dtype="<u8")
+            done = 0
+            for i, n in enumerate(layout):
+                first = (i*page+(0 if i else list_offset))//8
+                entries[first:first+n] = addr[done:done+n]
+                self._where[done:done+n] = np.arange(first, first+n)*8
+                done += n
+                if i < len(layout)-1:
+                    # chain to the next list page
+                    entries[first+n] = self.lists.phys_addr+(i+1)*page
+            self.lists[0:len(entries)*8] = entries.tobytes()
+            self.prp2 = self.lists.phys_addr+list_offset
+        self._entries = (self.prp1, self.prp2, entries)
+        self._dirty = False
+
+    def __len__(self):
+        """number of data pages, including the one of PRP1"""
+        return len(self._where)+1
+
+    def set_entry(self, index, addr):
+        """overwrite the PRP entry of data page index, e.g. to corrupt it"""
+
+        if index == 0:
+            self.prp1 = addr
+        elif self.lists is None:
+            self.prp2 = addr
+        else:
+            pos = int(self._where[index-1])
+            self.lists[pos:pos+8] = addr.to_bytes(8, "little")
+            self._dirty = True
+
+    def restore(self):
+        """undo set_entry(), so all entries point to the data pages again"""
+
+        self.prp1, self.prp2, entries = self._entries
+        if self._dirty:
+            self.lists[0:len(entries)*8] = entries.tobytes()
+            self._dirty = False
+
+    def fill(self, cmd):
+        """set PRP1 and PRP2 of the SQE"""
+        cmd[6] = self.prp1&0xffffffff
+        cmd[7] = self.prp1>>32
+        cmd[8] = self.prp2&0xffffffff
+        cmd[9] = self.prp2>>32
+        return cmd
+
+
+class PRPChainCache(object):
+    """recently used PRPChains, reused by commands of the same shape
+
+    Chains are keyed by (length, offset, list_offset, list_entries) and
+    the memory page size. A reused chain has its PRP entries restored.
+    Its data is filled again with the 32-bit pattern when ptype is 32,
+    and left as is otherwise.
+
+    max_chains: chains kept in the cache, the least recently used one
+    is released when it is full
+    """
+
+    def __init__(self, max_chains=4):
+        self.max_chains = max_chains
+        self._chains = collections.OrderedDict()
+        self.hit = 0
+        self.miss = 0
+
+    def get(self, nvme0, length, offset=0, list_offset=0, list_entries=None,
+            ptype=0, pvalue=0):
+        key = (page_size(nvme0), length, offset, list_offset, list_entries)
+        chain = self._chains.get(key)
+        if chain is not None:
+            self.hit += 1
+            self._chains.move_to_end(key)
+            chain.restore()
+            if ptype == 32:
+                fill(chain.data, "pattern32", pvalue)
+            return chain
+
+        self.miss += 1
+        chain = PRPChain(nvme0, length, offset, list_offset, list_entries,
+                         ptype, pvalue)
+        self._chains[key] = chain
+        while len(self._chains) > self.max_chains:
+            self._chains.popitem(last=False)
+        return chain
+
+    def clear(self):
+        self._chains.clear()
+
+    def stats(self):
+        return {"hit": self.hit, "miss": self.miss, "chains": len(self._chains)}
+
+
+class BufferPool(object):
+    """recycle DMA buffers in size classes of power of 2
+
+    get() returns a free buffer of the size class, or allocates a new one.
+    A recycled buffer is reset by the pool: zeroed by default, filled
+    with the pattern by reset="pattern", or left as is by reset=None.
+    put() returns the buffer to its class.
+
+    cls: Buffer, or PRP for buffers used in raw SQE
+    max_free: free buffers kept in each class, others are released
+    """
+
+    MIN_SIZE = 512
+
+    def __init__(self, cls=Buffer, reset="zero", pattern=b"\0", max_free=64):
+        assert reset in (None, "zero", "pattern")
+        self.cls = cls
+        self.reset = reset
+        self.pattern = pattern
+        self.max_free = max_free
+        self._free = {}
+        self._busy = {}  # size class of buffers in use, by id
+        self.hit = 0
+        self.miss = 0
+        self.allocated = 0
+
+    def size_class(self, size):
+        ret = self.MIN_SIZE
+        while ret < size:
+            ret <<= 1
+        return ret
+
+    def get(self, size=4096):
+        size = self.size_class(size)
+        free = self._free.setdefault(size, [])
+        if free:
+            self.hit += 1
+            buf = free.pop()
+            if self.reset == "zero":
+                buf[0:size] = bytes(size)
+            elif self.reset == "pattern":
+                buf[0:size] = (self.pattern*(size//len(self.pattern)+1))[:size]
+        else:
+            self.miss += 1
+            self.allocated += size
+            buf = self.cls(size)
+        self._busy[id(buf)] = size
+        return buf
+
+    def put(self, buf):
+        size = self._busy.pop(id(buf))
+        free = self._free.setdefault(size, [])
+        if len(free) < self.max_free:
+            free.append(buf)
+        else:
+            self.allocated -= size
+
+    @contextlib.contextmanager
+    def buffer(self, size=4096):
+        buf = self.get(size)
+        try:
+            yield buf
+        finally:
+            self.put(buf)
+
+    def stats(self):
+        """usage of the pool, and free buffers of each size class"""
+        return {"hit": self.hit,
+                "miss": self.miss,
+                "busy": len(self._busy),
+                "allocated": self.allocated,
+                "free": {k: len(v) for k, v in self._free.items()}}
@@ -0,0 +1,157 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import logging
+
+from nvme import Buffer
+from layout import decode_identify_controller, decode_identify_namespace, \
+    decode_identify_zns_namespace
+
+
+# events which change identify data
+EVENTS = ("format", "sanitize", "fw_commit", "ns_mgmt", "reset")
+
+# decoders of the records, by cns
+DECODERS = {0: decode_identify_namespace,
+            1: decode_identify_controller,
+            5: decode_identify_zns_namespace}
+
+
+class IdentifyCache(object):
+    """identify data shared by all tests in the session
+
+    Data is keyed by the controller and by (cns, nsid, csi). The
+    controller is known by its serial number and firmware revision,
+    which are read by one identify controller command the first time
+    each Controller object is used, so two controllers, or a new
+    firmware, never share the data.
+
+    format, sanitize: drop namespace data of the nsid, or all namespaces
+    ns_mgmt, fw_commit: drop all data of the controllers
+    reset: validate the serial number and firmware revision again
+
+    Fields changed by IO, e.g. NUSE, should still be read from the
+    device. Decoded records are cached along with the data.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._records = {}
+        self._keys = {}
+        self.hit = 0
+        self.miss = 0
+
+    def _identify(self, nvme0, cns, nsid, csi):
+        buf = Buffer(4096)
+        if csi:
+            nvme0.identify(buf, nsid=nsid, cns=cns, csi=csi).waitdone()
+        else:
+            nvme0.identify(buf, nsid=nsid, cns=cns).waitdone()
+        return buf[0:4096]
+
+    def _controller_key(self, nvme0):
+        key = self._keys.get(id(nvme0))
+        if key is None:
+            self.miss += 1
+            data = self._identify(nvme0, 1, 0, 0)
+            key = (data[4:24], data[64:72])  # SN, FR
+            self._keys[id(nvme0)] = key
+            if self._data.get(key+(1, 0, 0)) != data:
+                self._data[key+(1, 0, 0)] = data
+                self._records.pop(key+(1, 0, 0), None)
+            logging.debug("identify cache of controller %s" % (key,))
+        return key
+
+    def _entry(self, nvme0, cns, nsid, csi):
+        key = self._controller_key(nvme0)+(cns, nsid, csi)
+        if key in self._data:
+            self.hit += 1
+        else:
+            self.miss += 1
+            self._data[key] = self._identify(nvme0, cns, nsid, csi)
+        return key
+
+    def data(self, nvme0, cns=1, nsid=0, csi=0):
+        """the 4096-byte identify data structure, in bytes"""
+        return self._data[self._entry(nvme0, cns, nsid, csi)]
+
+    def record(self, nvme0, cns=1, nsid=0, csi=0):
+        """the identify data structure, as an immutable namedtuple"""
+
+        key = self._entry(nvme0, cns, nsid, csi)
+        if key not in self._records:
+            self._records[key] = DECODERS[cns](self._data[key])
+        return self._records[key]
+
+    def id_data(self, nvme0, byte_end, byte_begin=None, type=int,
+                nsid=0, cns=1, csi=0):
+        """same as Controller.id_data(), from the cache"""
+
+        if byte_begin is None:
+            byte_begin = byte_end
+        field = self.data(nvme0, cns, nsid, csi)[byte_begin:byte_end+1]
+        if type is str:
+            return field.decode("ascii", "ignore").strip("\0 ")
+        return int.from_bytes(field, "little")
+
+    def ns_data(self, nvme0, byte_end, byte_begin=None, nsid=1):
+        """same as Namespace.id_data(), from the cache"""
+        return self.id_data(nvme0, byte_end, byte_begin, nsid=nsid, cns=0)
+
+    def controller(self, nvme0):
+        return self.record(nvme0)
+
+    def namespace(self, nvme0, nsid=1):
+        return self.record(nvme0, 0, nsid)
+
+    def zns_namespace(self, nvme0, nsid=1):
+        return self.record(nvme0, 5, nsid, csi=2)
+
+    def ns_descriptors(self, nvme0, nsid=1):
+        return self.data(nvme0, 3, nsid)
+
+    def lba_size(self, nvme0, nsid=1):
+        """bytes of the LBA format in use"""
+        id_ns = self.namespace(nvme0, nsid)
+        return 1<<((id_ns.lbaf[id_ns.flbas&0xf]>>16)&0xff)
+
+    def event(self, name, nsid=None):
+        """invalidate the data changed by the event"""
+
+        assert name in EVENTS
+        logging.debug("identify cache event: %s, nsid %s" % (name, nsid))
+        if name == "reset":
+            self._keys.clear()
+            return
+
+        for key in list(self._data):
+            cns, key_nsid = key[2:4]
+            if name in ("ns_mgmt", "fw_commit"):
+                del self._data[key]
+            elif cns != 1 and (nsid in (None, 0xffffffff) or key_nsid == nsid):
+                del self._data[key]
+        for key in list(self._records):
+            if key not in self._data:
+                del self._records[key]
+        if name in ("ns_mgmt", "fw_commit"):
+            self._keys.clear()
+
+    def stats(self):
+        return {"hit": self.hit, "miss": self.miss, "entries": len(self._data)}
@@ -0,0 +1,271 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import collections
+import numpy as np
+
+
+# layouts of data structures in NVMe specification, as numpy dtypes
+# fields: list of (name, byte offset, numpy format)
+def struct(fields, itemsize):
+    names, offsets, formats = zip(*fields)
+    return np.dtype({"names": names,
+                     "offsets": offsets,
+                     "formats": formats,
+                     "itemsize": itemsize})
+
+
+# 128-bit counters are 2 little endian 64-bit words
+U128 = ("<u8", 2)
+
+
+def u128(value):
+    return int(value[0])+(int(value[1])<<64)
+
+
+POWER_STATE = struct([
+    ("mp", 0, "<u2"),
+    ("flags", 3, "u1"),      # mxps: bit 0, nops: bit 1
+    ("enlat", 4, "<u4"),
+    ("exlat", 8, "<u4"),
+    ("rrt", 12, "u1"),
+    ("rrl", 13, "u1"),
+    ("rwt", 14, "u1"),
+    ("rwl", 15, "u1"),
+    ("idlp", 16, "<u2"),
+    ("ips", 18, "u1"),
+    ("actp", 20, "<u2"),
+    ("apw", 22, "u1"),
+], 32)
+
+
+IDENTIFY_CONTROLLER = struct([
+    ("vid", 0, "<u2"),
+    ("ssvid", 2, "<u2"),
+    ("sn", 4, "S20"),
+    ("mn", 24, "S40"),
+    ("fr", 64, "S8"),
+    ("rab", 72, "u1"),
+    ("cmic", 76, "u1"),
+    ("mdts", 77, "u1"),
+    ("cntlid", 78, "<u2"),
+    ("ver", 80, "<u4"),
+    ("rtd3r", 84, "<u4"),
+    ("rtd3e", 88, "<u4"),
+    ("oaes", 92, "<u4"),
+    ("ctratt", 96, "<u4"),
+    ("oacs", 256, "<u2"),
+    ("acl", 258, "u1"),
+    ("aerl", 259, "u1"),
+    ("frmw", 260, "u1"),
+    ("lpa", 261, "u1"),
+    ("elpe", 262, "u1"),
+    ("npss", 263, "u1"),
+    ("avscc", 264, "u1"),
+    ("apsta", 265, "u1"),
+    ("wctemp", 266, "<u2"),
+    ("cctemp", 268, "<u2"),
+    ("mtfa", 270, "<u2"),
+    ("hmpre", 272, "<u4"),
+    ("hmmin", 276, "<u4"),
+    ("tnvmcap", 280, U128),
+    ("unvmcap", 296, U128),
+    ("rpmbs", 312, "<u4"),
+    ("edstt", 316, "<u2"),
+    ("dsto", 318, "u1"),
+    ("fwug", 319, "u1"),
+    ("kas", 320, "<u2"),
+    ("hctma", 322, "<u2"),
+    ("mntmt", 324, "<u2"),
+    ("mxtmt", 326, "<u2"),
+    ("sanicap", 328, "<u4"),
+    ("anacap", 343, "u1"),
+    ("sqes", 512, "u1"),
+    ("cqes", 513, "u1"),
+    ("maxcmd", 514, "<u2"),
+    ("nn", 516, "<u4"),
+    ("oncs", 520, "<u2"),
+    ("fuses", 522, "<u2"),
+    ("fna", 524, "u1"),
+    ("vwc", 525, "u1"),
+    ("awun", 526, "<u2"),
+    ("awupf", 528, "<u2"),
+    ("nvscc", 530, "u1"),
+    ("nwpc", 531, "u1"),
+    ("acwu", 532, "<u2"),
+    ("sgls", 536, "<u4"),
+    ("mnan", 540, "<u4"),
+    ("subnqn", 768, "S256"),
+    ("psd", 2048, (POWER_STATE, 32)),
+], 4096)
+
+
+IDENTIFY_NAMESPACE = struct([
+    ("nsze", 0, "<u8"),
+    ("ncap", 8, "<u8"),
+    ("nuse", 16, "<u8"),
+    ("nsfeat", 24, "u1"),
+    ("nlbaf", 25, "u1"),
+    ("flbas", 26, "u1"),
+    ("mc", 27, "u1"),
+    ("dpc", 28, "u1"),
+    ("dps", 29, "u1"),
+    ("nmic", 30, "u1"),
+    ("rescap", 31, "u1"),
+    ("fpi", 32, "u1"),
+    ("dlfeat", 33, "u1"),
+    ("nawun", 34, "<u2"),
+    ("nawupf", 36, "<u2"),
+    ("nacwu", 38, "<u2"),
+    ("nabsn", 40, "<u2"),
+    ("nabo", 42, "<u2"),
+    ("nabspf", 44, "<u2"),
+    ("noiob", 46, "<u2"),
+    ("nvmcap", 48, U128),
+    ("npwg", 64, "<u2"),
+    ("npwa", 66, "<u2"),
+    ("npdg", 68, "<u2"),
+    ("npda", 70, "<u2"),
+    ("nows", 72, "<u2"),
+    ("anagrpid", 92, "<u4"),
+    ("nsattr", 99, "u1"),
+    ("nvmsetid", 100, "<u2"),
+    ("endgid", 102, "<u2"),
+    ("nguid", 104, "V16"),
+    ("eui64", 120, "V8"),
+    ("lbaf", 128, ("<u4", 16)),
+], 4096)
+
+
+# LBA format extension of zoned namespace
+ZONE_FORMAT = struct([
+    ("zsze", 0, "<u8"),
+    ("zdes", 8, "u1"),
+], 16)
+
+
+IDENTIFY_ZNS_NAMESPACE = struct([
+    ("zoc", 0, "<u2"),
+    ("ozcs", 2, "<u2"),
+    ("mar", 4, "<u4"),
+    ("mor", 8, "<u4"),
+    ("rrl", 12, "<u4"),
+    ("frl", 16, "<u4"),
+    ("lbafe", 2816, (ZONE_FORMAT, 16)),
+], 4096)
+
+
+SMART_LOG = struct([
+    ("critical_warning", 0, "u1"),
+    ("temperature", 1, "<u2"),
+    ("avail_spare", 3, "u1"),
+    ("spare_thresh", 4, "u1"),
+    ("percent_used", 5, "u1"),
+    ("endgcws", 6, "u1"),
+    ("data_units_read", 32, U128),
+    ("data_units_written", 48, U128),
+    ("host_reads", 64, U128),
+    ("host_writes", 80, U128),
+    ("ctrl_busy_time", 96, U128),
+    ("power_cycles", 112, U128),
+    ("power_on_hours", 128, U128),
+    ("unsafe_shutdowns", 144, U128),
+    ("media_errors", 160, U128),
+    ("num_err_log_entries", 176, U128),
+    ("warning_temp_time", 192, "<u4"),
+    ("crit_comp_time", 196, "<u4"),
+    ("temp_sensor", 200, ("<u2", 8)),
+    ("tmt1_trans_count", 216, "<u4"),
+    ("tmt2_trans_count", 220, "<u4"),
+    ("tmt1_total_time", 224, "<u4"),
+    ("tmt2_total_time", 228, "<u4"),
+], 512)
+
+
+# zone report of zone management receive: a header, and descriptors
+ZONE_REPORT_HEADER = struct([
+    ("nr_zones", 0, "<u8"),
+], 64)
+
+
+ZONE_DESCRIPTOR = struct([
+    ("zt", 0, "u1"),
+    ("zs", 1, "u1"),         # zone state: bits 7:4
+    ("za", 2, "u1"),
+    ("zai", 3, "u1"),
+    ("zcap", 8, "<u8"),
+    ("zslba", 16, "<u8"),
+    ("wp", 24, "<u8"),
+], 64)
+
+
+# decoders of the layouts, by dtype
+_decoders = {}
+
+
+class Decoder(object):
+    """decode a data structure into an immutable namedtuple
+
+    The converter of every field is compiled once from the dtype, so a
+    decode is one numpy copy of the data plus one pass over the fields:
+    strings are stripped, 128-bit counters become int, arrays become tuples
+    and nested structures become records of their own decoders.
+    """
+
+    def __init__(self, dtype, name):
+        self.dtype = dtype
+        self.record = collections.namedtuple(name, dtype.names)
+        self._converters = tuple(self._converter(dtype.fields[n][0])
+                                 for n in dtype.names)
+        _decoders[dtype] = self
+
+    @staticmethod
+    def _converter(field):
+        if field.kind == "S":
+            return lambda v: v.decode("ascii", "ignore").strip("\0 ")
+        if field.subdtype is None:
+            return None
+        base, shape = field.subdtype
+        if base.names is not None:
+            make = _decoders[base]._make
+            return lambda v: tuple(make(x.item()) for x in v)
+        if field.shape == U128[1:]:
+            return u128
+        return lambda v: tuple(v.tolist())
+
+    def _make(self, value):
+        return self.record._make(v if f is None else f(v)
+                                 for f, v in zip(self._converters, value))
+
+    def __call__(self, data, offset=0):
+        """the record of the structure at offset of bytes or a Buffer"""
+
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = data[offset:offset+self.dtype.itemsize]
+            offset = 0
+        return self._make(np.frombuffer(data, self.dtype, 1, offset)[0].item())
+
+
+decode_power_state = Decoder(POWER_STATE, "PowerState")
+decode_identify_controller = Decoder(IDENTIFY_CONTROLLER, "IdentifyController")
+decode_identify_namespace = Decoder(IDENTIFY_NAMESPACE, "IdentifyNamespace")
+decode_zone_format = Decoder(ZONE_FORMAT, "ZoneFormat")
+decode_identify_zns_namespace = Decoder(IDENTIFY_ZNS_NAMESPACE, "IdentifyZnsNamespace")
+decode_smart_log = Decoder(SMART_LOG, "SmartLog")
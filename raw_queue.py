@@ -0,0 +1,514 @@
+# Copyright (C) 2020 Crane Chu <cranechu@gmail.com>
+# This file is part of pynvme's conformance test
+#
+# pynvme's conformance test is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# pynvme's conformance test is distributed in the hope that it will be
+# useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pynvme's conformance test. If not, see
+# <http://www.gnu.org/licenses/>.
+
+# -*- coding: utf-8 -*-
+
+
+import os
+import time
+import threading
+import numpy as np
+
+from nvme import Buffer
+from scripts.psd import IOCQ as _IOCQ, IOSQ as _IOSQ, SQE
+
+
+# how to wait when the next completion entry is not posted yet
+WAIT_STRATEGIES = ("spin", "yield", "backoff")
+BACKOFF_MIN = 0.00001
+BACKOFF_MAX = 0.001
+
+# when a queue writes the updated tail or head to its doorbell
+DOORBELL_POLICIES = ("immediate", "every", "timed", "flush")
+
+# decoded fields of a completion queue entry
+CQE_DTYPE = np.dtype([("dw0", np.uint32),
+                      ("dw1", np.uint32),
+                      ("sqhd", np.uint16),
+                      ("sqid", np.uint16),
+                      ("cid", np.uint16),
+                      ("phase", np.uint8),
+                      ("sct", np.uint8),
+                      ("sc", np.uint8),
+                      ("more", np.uint8),
+                      ("dnr", np.uint8)])
+
+
+def decode_cqes(raw):
+    """decode the bytes of completion entries into an array of CQE_DTYPE"""
+
+    dw = np.frombuffer(raw, dtype="<u4").reshape(-1, 4)
+    ret = np.empty(len(dw), dtype=CQE_DTYPE)
+    ret["dw0"] = dw[:, 0]
+    ret["dw1"] = dw[:, 1]
+    ret["sqhd"] = dw[:, 2]&0xffff
+    ret["sqid"] = dw[:, 2]>>16
+    ret["cid"] = dw[:, 3]&0xffff
+    ret["phase"] = (dw[:, 3]>>16)&0x1
+    ret["sc"] = (dw[:, 3]>>17)&0xff
+    ret["sct"] = (dw[:, 3]>>25)&0x7
+    ret["more"] = (dw[:, 3]>>30)&0x1
+    ret["dnr"] = dw[:, 3]>>31
+    return ret
+
+
+_fence = threading.Lock()
+
+
+def _barrier():
+    # Python has no memory barrier. This relies on CPython on x86, where
+    # acquiring a lock is a locked read-modify-write instruction, a full
+    # barrier, so the stores before it are visible before the loads after
+    # it. Other architectures are not guaranteed to order them.
+    with _fence:
+        pass
+
+
+def pause(strategy, delay):
+    """wait once with the strategy, return the delay of the next wait
+
+    spin returns at once, yield gives up the cpu, and backoff sleeps
+    delay seconds, which doubles up to BACKOFF_MAX.
+    """
+
+    if strategy == "yield":
+        os.sched_yield()
+    elif strategy == "backoff":
+        time.sleep(delay)
+        delay = min(delay*2, BACKOFF_MAX)
+    return delay
+
+
+class CQEView(object):
+    """read fields of one completion entry in place, without copying it
+
+    The view can be moved to another slot, so a spin loop reuses one view.
+    """
+
+    __slots__ = ("_prp", "slot")
+
+    def __init__(self, cq, slot=0):
+        self._prp = cq._prp
+        self.slot = slot
+
+    def dword(self, index):
+        base = self.slot*16+index*4
+        return self._prp.data(base+3, base)
+
+    @property
+    def p(self):
+        return (self.dword(3)>>16)&0x1
+
+    @property
+    def cid(self):
+        return self.dword(3)&0xffff
+
+    @property
+    def status(self):
+        return (self.dword(3)>>17)&0x7ff
+
+    @property
+    def sqid(self):
+        return self.dword(2)>>16
+
+    @property
+    def sqhd(self):
+        return self.dword(2)&0xffff
+
+
+class DoorbellBuffer(object):
+    """shadow doorbell and EventIdx buffers of Doorbell Buffer Config (0x7C)
+
+    Raw queues created with the DoorbellBuffer write their tail and head
+    to the shadow doorbells, and write the MMIO doorbell only when the
+    new value passes the EventIdx of the controller. The buffers are set
+    until the controller is reset, so do not use Qpair or ioworker, which
+    still write MMIO doorbells only, after it.
+    """
+
+    def __init__(self, nvme0):
+        self.stride = 4<<((nvme0.cap>>32)&0xf)
+        # shadow doorbell page, then EventIdx page, as PRP1 and PRP2
+        self._buf = Buffer(8192, "shadow doorbell")
+        nvme0.send_cmd(0x7c, self._buf).waitdone()
+
+    def update(self, qid, cq, old, new):
+        """write the shadow doorbell, return True if MMIO write is needed"""
+
+        offset = (2*qid+cq)*self.stride
+        self._buf[offset:offset+4] = new.to_bytes(4, "little")
+
+        # the shadow write is visible before the EventIdx is read, see
+        # _barrier() for the assumption
+        _barrier()
+        event = self._buf.data(4096+offset+3, 4096+offset)
+        return (new-event-1)&0xffff < (new-old)&0xffff
+
+
+class Doorbell(object):
+    """policy of a raw queue to write its updated tail or head doorbell
+
+    immediate: write every update
+    every: write every count updates
+    timed: write an update interval seconds after the last write
+    flush: write only when flush() of the queue is called
+
+    The policy holds no state, so queues can share it. A deferred update
+    is written by the next update due, or by flush(), so call flush()
+    before waiting for the entries it depends on.
+    """
+
+    def __init__(self, policy="immediate", count=8, interval=0.00005):
+        assert policy in DOORBELL_POLICIES
+        self.policy = policy
+        self.count = count
+        self.interval = interval
+
+    def __repr__(self):
+        if self.policy == "every":
+            return "every %d" % self.count
+        if self.policy == "timed":
+            return "timed %gus" % (self.interval*1000000)
+        return self.policy
+
+    def due(self, pending, last):
+        """if pending updates since the last write at last should be written"""
+
+        if self.policy == "immediate":
+            return True
+        if self.policy == "every":
+            return pending >= self.count
+        if self.policy == "timed":
+            return time.perf_counter()-last >= self.interval
+        return False
+
+
+class _DoorbellQueue(object):
+    """tail or head updates of a raw queue, written by its Doorbell policy
+
+    doorbell_updates: the values assigned to the tail or head
+    doorbell_writes: the values written to the doorbell, or to its shadow
+    mmio_writes: the values written to the doorbell register
+    """
+
+    _cq = 0
+
+    def _init_doorbell(self, dbbuf, doorbell):
+        self._dbbuf = dbbuf
+        self._doorbell = doorbell or Doorbell()
+        self._value = 0
+        self._written = 0
+        self._pending = 0
+        self._last = time.perf_counter()
+        self.doorbell_updates = 0
+        self.doorbell_writes = 0
+        self.mmio_writes = 0
+
+    def _update(self, value):
+        self._value = value
+        self._pending += 1
+        self.doorbell_updates += 1
+        if self._doorbell.due(self._pending, self._last):
+            self.flush()
+
+    def flush(self):
+        """write the last update to the doorbell, if it is deferred"""
+
+        if not self._pending:
+            return
+        old = self._written
+        self._written = self._value
+        self._pending = 0
+        self._last = time.perf_counter()
+        self.doorbell_writes += 1
+        if self._dbbuf is None or \
+           self._dbbuf.update(self.id, self._cq, old, self._value):
+            self._write(self._value)
+            self.mmio_writes += 1
+
+
+class IOCQ(_DoorbellQueue, _IOCQ):
+    """IO completion queue which tracks the phase tag of its next entry
+
+    waitdone() reaps the entries posted after the last reaped one, and
+    follows the inverted phase tag when the queue wraps.
+
+    dbbuf: DoorbellBuffer to update the head doorbell through
+    doorbell: Doorbell policy of head updates, immediate by default
+    """
+
+    _cq = 1
+
+    def __init__(self, ctrlr, qid, qsize, prp1, *args,
+                 dbbuf=None, doorbell=None, **kwargs):
+        super(IOCQ, self).__init__(ctrlr, qid, qsize, prp1, *args, **kwargs)
+        self._init_doorbell(dbbuf, doorbell)
+        self.qsize = qsize
+        self._prp = prp1
+        self._slot = 0
+        self._phase = 1
+        self._view = CQEView(self)
+
+    @property
+    def head(self):
+        return self._value
+
+    @head.setter
+    def head(self, head):
+        self._update(head)
+
+    def _write(self, head):
+        _IOCQ.head.fset(self, head)
+
+    @property
+    def slot(self):
+        """the slot of the next completion entry to be reaped"""
+        return self._slot
+
+    @property
+    def phase(self):
+        """the expected phase tag of the next completion entry"""
+        return self._phase
+
+    def view(self, slot=0):
+        """a CQEView on the slot of this queue"""
+        return CQEView(self, slot)
+
+    def snapshot(self, start=0, count=None):
+        """copy the whole queue once, and decode it into an array of CQE_DTYPE
+
+        start, count: return count entries from slot start, around the
+        end of the queue.
+        """
+
+        ret = decode_cqes(self._prp[0:self.qsize*16])
+        if start == 0 and count is None:
+            return ret
+        if count is None:
+            count = self.qsize
+        return ret[(start+np.arange(count))%self.qsize]
+
+    def _entries(self, start, count):
+        # decode count entries from the slot start, around the end
+        end = start+count
+        if end <= self.qsize:
+            return decode_cqes(self._prp[start*16:end*16])
+        return decode_cqes(self._prp[start*16:self.qsize*16]+
+                           self._prp[0:(end-self.qsize)*16])
+
+    def _reap(self, count):
+        # spin on the phase tag in place, then decode the entries in one copy
+        start = self._slot
+        reaped = 0
+        view = self._view
+        while reaped < count:
+            view.slot = self._slot
+            if view.p != self._phase:
+                break
+            reaped += 1
+            self._slot += 1
+            if self._slot == self.qsize:
+                self._slot = 0
+                self._phase ^= 1
+        return self._entries(start, reaped)
+
+    def poll(self, count=None, update_head=False):
+        """reap the completion entries already posted, without waiting
+
+        count: reap at most count entries, all posted entries by default
+        return: the entries reaped, a record array of CQE_DTYPE
+        """
+
+        ret = self._reap(self.qsize if count is None else count)
+        if update_head and len(ret):
+            self.head = self._slot
+        return ret.view(np.recarray)
+
+    def waitdone(self, count=1, timeout=10, strategy="spin", update_head=False):
+        """wait for count new completion entries
+
+        strategy: spin, yield the cpu, or sleep with exponential backoff
+        update_head: write CQ head doorbell after entries are reaped
+        return: the entries reaped in the order of the queue, a record
+                array of CQE_DTYPE
+        """
+
+        assert strategy in WAIT_STRATEGIES
+        assert count < self.qsize or update_head
+
+        ret = [np.empty(0, dtype=CQE_DTYPE)]
+        reaped = 0
+        deadline = time.time()+timeout
+        delay = BACKOFF_MIN
+        while True:
+            # decode before the head lets the controller post over them
+            entries = self._reap(count-reaped)
+            if len(entries):
+                ret.append(entries)
+                reaped += len(entries)
+                delay = BACKOFF_MIN
+                if update_head:
+                    self.head = self._slot
+            if reaped == count:
+                return np.concatenate(ret).view(np.recarray)
+
+            if time.time() > deadline:
+                raise TimeoutError("IOCQ %d: %d of %d completions in %gs" %
+                                   (self.id, reaped, count, timeout))
+            delay = pause(strategy, delay)
+
+    def reap(self, count=1, timeout=10, strategy="spin", update_head=False):
+        """wait for count new completion entries, without decoding them
+
+        The controller posts entries in the order of slots, so only the
+        phase tag of the last entry is polled.
+        return: the slot of the next completion entry
+        """
+
+        assert strategy in WAIT_STRATEGIES
+        assert 0 < count < self.qsize
+
+        last = self._slot+count-1
+        phase = self._phase
+        if last >= self.qsize:
+            last -= self.qsize
+            phase ^= 1
+
+        deadline = time.time()+timeout
+        delay = BACKOFF_MIN
+        while (self._prp.data(last*16+15, last*16+12)>>16)&1 != phase:
+            if time.time() > deadline:
+                raise TimeoutError("IOCQ %d: %d completions in %gs" %
+                                   (self.id, count, timeout))
+            delay = pause(strategy, delay)
+
+        self._slot = last+1
+        self._phase = phase
+        if self._slot == self.qsize:
+            self._slot = 0
+            self._phase ^= 1
+        if update_head:
+            self.head = self._slot
+        return self._slot
+
+
+class SQEBatch(object):
+    """a batch of submission entries, 64 bytes each in one contiguous array
+
+    The setters fill the field of all entries at once, and return the
+    batch itself, so they can be chained.
+    """
+
+    def __init__(self, count, opcode=0, nsid=0):
+        self.dw = np.zeros((count, 16), dtype=np.uint32)
+        self.opcode(opcode)
+        self.nsid(nsid)
+
+    def __len__(self):
+        return len(self.dw)
+
+    def __getitem__(self, index):
+        return SQE(*self.dw[index].tolist())
+
+    def __setitem__(self, index, cmd):
+        self.dw[index] = cmd
+
+    def tobytes(self):
+        return self.dw.astype("<u4").tobytes()
+
+    def cdw(self, index, value):
+        """set dword index of all entries, value is a scalar or a sequence"""
+        self.dw[:, index] = value
+        return self
+
+    def opcode(self, opc):
+        self.dw[:, 0] = (self.dw[:, 0]&0xffffff00)|opc
+        return self
+
+    def cid(self, start=0, step=1):
+        cid = (start+np.arange(len(self), dtype=np.uint32)*step)&0xffff
+        self.dw[:, 0] = (self.dw[:, 0]&0xffff)|(cid<<16)
+        return self
+
+    def nsid(self, nsid):
+        self.dw[:, 1] = nsid
+        return self
+
+    def slba(self, start, step=0):
+        """starting lba of each entry: start, start+step, start+2*step, ..."""
+        slba = start+np.arange(len(self), dtype=np.uint64)*np.uint64(step)
+        self.dw[:, 10] = slba&0xffffffff
+        self.dw[:, 11] = slba>>np.uint64(32)
+        return self
+
+    def nlb(self, nlb):
+        """number of logical blocks, 0-based as in the command"""
+        self.dw[:, 12] = (self.dw[:, 12]&0xffff0000)|nlb
+        return self
+
+    def _prp(self, index, buf_list):
+        addr = np.array([b.phys_addr for b in buf_list], dtype=np.uint64)
+        addr = np.resize(addr, len(self))  # reuse the buffer pool around
+        self.dw[:, index] = addr&0xffffffff
+        self.dw[:, index+1] = addr>>np.uint64(32)
+        return self
+
+    def prp1(self, buf_list):
+        return self._prp(6, buf_list)
+
+    def prp2(self, buf_list):
+        return self._prp(8, buf_list)
+
+
+class IOSQ(_DoorbellQueue, _IOSQ):
+    """IO submission queue which can be filled with a SQEBatch in one copy
+
+    dbbuf: DoorbellBuffer to update the tail doorbell through
+    doorbell: Doorbell policy of tail updates, immediate by default
+    """
+
+    def __init__(self, ctrlr, qid, qsize, prp1, *args,
+                 dbbuf=None, doorbell=None, **kwargs):
+        super(IOSQ, self).__init__(ctrlr, qid, qsize, prp1, *args, **kwargs)
+        self._init_doorbell(dbbuf, doorbell)
+        self.qsize = qsize
+        self._prp = prp1
+
+    @property
+    def tail(self):
+        return self._value
+
+    @tail.setter
+    def tail(self, tail):
+        self._update(tail)
+
+    def _write(self, tail):
+        _IOSQ.tail.fset(self, tail)
+
+    def put(self, batch, slot=0):
+        """copy the batch into the queue from the slot, around the end
+
+        return: the slot after the last entry, which is the new tail
+        """
+
+        assert len(batch) <= self.qsize
+        data = batch.tobytes()
+        first = min(len(batch), self.qsize-slot)*64
+        self._prp[slot*64:slot*64+first] = data[:first]
+        if first < len(data):
+            self._prp[0:len(data)-first] = data[first:]
+        return (slot+len(batch))%self.qsize